@@ -1,58 +1,281 @@
-import requests
 import json
 import sys
-from datetime import datetime
-from typing import Dict, Optional, Tuple
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import quote
+from typing import Dict, List, Optional, Tuple
 from flask import Flask, render_template, request, jsonify
 import os
+from launch_store import LaunchStore
+from upstream import UpstreamClient
 
 # Configure Flask to use frontend directories
 app = Flask(__name__, 
             template_folder='../frontend',
             static_folder='../frontend/static')
 
-class SpaceXAPIClient:
-    # SpaceX API client for fetching launch data
+# Every upstream call goes through one keep-alive connection pool. 429 and 5xx
+# responses are retried with jittered exponential backoff (or after Retry-After),
+# and after UPSTREAM_BREAKER_THRESHOLD failures in a row requests fail fast for
+# UPSTREAM_BREAKER_RESET seconds.
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', '10'))
+UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', '3'))
+UPSTREAM_BREAKER_THRESHOLD = int(os.environ.get('UPSTREAM_BREAKER_THRESHOLD', '5'))
+UPSTREAM_BREAKER_RESET = float(os.environ.get('UPSTREAM_BREAKER_RESET', '30'))
+upstream_client = UpstreamClient(pool_size=UPSTREAM_POOL_SIZE, max_retries=UPSTREAM_MAX_RETRIES,
+                                 failure_threshold=UPSTREAM_BREAKER_THRESHOLD,
+                                 reset_timeout=UPSTREAM_BREAKER_RESET)
+
+# Launch Library 2 endpoints
+LAUNCH_LIBRARY_URL = "https://ll.thespacedevs.com/2.2.0"
+SYNC_LAUNCHES_URL = f"{LAUNCH_LIBRARY_URL}/launch/previous/?format=json&search=SpaceX&ordering=net&limit=100"
+
+# Upstream responses stay fresh for CACHE_TTL seconds, then are served stale for
+# up to CACHE_STALE_SECONDS more while a background refresh runs
+CACHE_TTL = float(os.environ.get('CACHE_TTL', '300'))
+CACHE_STALE_SECONDS = float(os.environ.get('CACHE_STALE_SECONDS', '3600'))
+CACHE_MAX_ENTRIES = 256
+
+class ResponseCache:
+    # Parsed upstream JSON by URL, shared by every route
     
-    def __init__(self):
-        self.base_url = "https://api.spacexdata.com/v5"
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'SpaceXAPIClient/1.0'
-        })
+    def __init__(self, ttl: float, stale_seconds: float, max_entries: int):
+        self.ttl = ttl
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # url -> (fetched_at, data)
+        self.refreshing = set()
+        self.lock = threading.Lock()
+    
+    def put(self, url: str, data: Dict):
+        with self.lock:
+            self.entries[url] = (time.monotonic(), data)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def lookup(self, url: str) -> Tuple[Optional[Dict], str, bool]:
+        # Returns (data, 'HIT' | 'STALE' | 'MISS', whether the caller should start a refresh)
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                self.entries.move_to_end(url)
+                age = time.monotonic() - entry[0]
+                if age < self.ttl:
+                    return entry[1], 'HIT', False
+                if age < self.ttl + self.stale_seconds:
+                    # One refresh per URL at a time
+                    start_refresh = url not in self.refreshing
+                    self.refreshing.add(url)
+                    return entry[1], 'STALE', start_refresh
+        return None, 'MISS', False
     
-    def get_latest_launch(self) -> Tuple[bool, Dict]:
-        # Get latest SpaceX launch
+    def refresh_done(self, url: str, data: Optional[Dict] = None, error: Optional[Exception] = None):
+        if error is not None:
+            # Keep serving the stale copy until it ages out
+            print(f"Background refresh of {url} failed: {str(error)}")
+        else:
+            self.put(url, data)
+        with self.lock:
+            self.refreshing.discard(url)
+    
+    def refresh(self, url: str, fetch):
         try:
-            url = f"{self.base_url}/launches/latest"
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            return True, data
+            data = fetch(url)
         except Exception as e:
-            return False, {"error": f"Failed to fetch latest launch: {str(e)}"}
+            self.refresh_done(url, error=e)
+        else:
+            self.refresh_done(url, data)
     
-    def get_launch_by_id(self, launch_id: str) -> Tuple[bool, Dict]:
-        # Get specific launch by ID
+    def get(self, url: str, fetch) -> Tuple[Dict, str]:
+        # Returns (data, 'HIT' | 'STALE' | 'MISS'); fetch(url) is only called on a miss
+        data, cache_status, start_refresh = self.lookup(url)
+        if start_refresh:
+            threading.Thread(target=self.refresh, args=(url, fetch), daemon=True).start()
+        if cache_status != 'MISS':
+            return data, cache_status
+        
+        data = fetch(url)
+        self.put(url, data)
+        return data, 'MISS'
+
+response_cache = ResponseCache(CACHE_TTL, CACHE_STALE_SECONDS, CACHE_MAX_ENTRIES)
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution and its result
+    
+    def __init__(self):
+        self.calls = {}  # key -> [done event, result, exception]
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.deduplicated = 0
+    
+    def do(self, key: str, function):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = [threading.Event(), None, None]
+                self.executed += 1
+                leader = True
+            else:
+                self.deduplicated += 1
+                leader = False
+        
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        
         try:
-            url = f"{self.base_url}/launches/{launch_id}"
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            return True, data
+            call[1] = function()
+            return call[1]
         except Exception as e:
-            return False, {"error": f"Failed to fetch launch data: {str(e)}"}
+            # Waiting callers see the same error
+            call[2] = e
+            raise
+        finally:
+            # Later callers start a new fetch; the cache answers them once it is filled
+            with self.lock:
+                del self.calls[key]
+            call[0].set()
     
-    def test_connection(self) -> bool:
-        # Test API connection
-        try:
-            success, data = self.get_latest_launch()
-            return success
-        except Exception:
-            return False
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                'executed': self.executed,
+                'deduplicated': self.deduplicated
+            }
+
+upstream_flights = SingleFlight()
+
+def fetch_json(url: str) -> Dict:
+    # Fetch and parse one upstream response, raising on HTTP errors
+    return upstream_client.get_json(url)
 
-# Initialize the SpaceX API client
-spacex_client = SpaceXAPIClient()
+def coalesced_fetch_json(url: str) -> Dict:
+    # Callers asking for a URL that is already being fetched wait for that fetch
+    return upstream_flights.do(url, lambda: fetch_json(url))
+
+def cached_json(url: str) -> Tuple[Dict, str]:
+    return response_cache.get(url, coalesced_fetch_json)
+
+def with_cache_status(response, cache_status: str):
+    # Report whether the upstream data came from the cache
+    response.headers['X-Cache'] = cache_status
+    return response
+
+def combined_cache_status(statuses) -> str:
+    # A response built from several lookups reports the slowest one
+    for cache_status in ['MISS', 'STALE', 'HIT']:
+        if cache_status in statuses:
+            return cache_status
+    return 'STORE'
+
+def launch_url(launch_id: str) -> str:
+    return f"{LAUNCH_LIBRARY_URL}/launch/{quote(launch_id, safe='')}/?format=json"
+
+def format_launch(launch: Dict) -> Dict:
+    # Convert to SpaceX API format for compatibility
+    status_name = launch.get('status', {}).get('name', '').lower()
+    is_successful = 'success' in status_name or 'successful' in status_name
+    
+    return {
+        'id': str(launch.get('id', '')),
+        'name': launch.get('name', 'Unknown Mission'),
+        'date_utc': launch.get('net', ''),
+        'success': is_successful,
+        'flight_number': launch.get('launch_service_provider', {}).get('id', 0),
+        'details': launch.get('mission', {}).get('description', ''),
+        'links': {
+            'webcast': launch.get('vidURLs', [{}])[0].get('url', '') if launch.get('vidURLs') else '',
+            'article': launch.get('infoURLs', [{}])[0].get('url', '') if launch.get('infoURLs') else '',
+            'wikipedia': launch.get('infoURLs', [{}])[1].get('url', '') if len(launch.get('infoURLs', [])) > 1 else ''
+        },
+        'cores': []  # Launch Library doesn't have core data
+    }
+
+# Past SpaceX launches are kept in a local SQLite store. The first sync pages
+# through all of them; later syncs only fetch launches from the newest stored
+# 'net' onwards, at most once per LAUNCH_SYNC_INTERVAL seconds.
+LAUNCH_DB = os.environ.get('LAUNCH_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'launches.db'))
+LAUNCH_SYNC_INTERVAL = float(os.environ.get('LAUNCH_SYNC_INTERVAL', '600'))
+DEFAULT_QUERY_LIMIT = 50
+MAX_QUERY_LIMIT = 500
+launch_store = LaunchStore(LAUNCH_DB)
+launch_sync_lock = threading.Lock()
+
+def sync_launches() -> int:
+    # Fetch every past launch at or after the watermark, oldest first, a page at a time
+    url = SYNC_LAUNCHES_URL
+    watermark = launch_store.watermark()
+    if watermark:
+        url += f"&net__gte={quote(watermark)}"
+    
+    synced = 0
+    while url:
+        page = fetch_json(url)
+        launches = page.get('results', [])
+        # Pages are stored as they arrive, so an interrupted sync resumes from the last one
+        launch_store.upsert([(format_launch(launch), launch.get('status', {}).get('abbrev', ''))
+                             for launch in launches])
+        synced += len(launches)
+        url = page.get('next')
+    launch_store.mark_synced()
+    return synced
+
+def background_sync():
+    if not launch_sync_lock.acquire(blocking=False):
+        return
+    try:
+        sync_launches()
+    except Exception as e:
+        # Keep serving the stored launches; the next request retries
+        print(f"Launch sync failed: {str(e)}")
+    finally:
+        launch_sync_lock.release()
+
+def ensure_launches_synced():
+    # An empty store blocks on the initial sync (shared by concurrent requests);
+    # otherwise a due sync runs in the background
+    if launch_store.count() == 0:
+        upstream_flights.do('launch-sync', sync_launches)
+    elif time.time() - launch_store.last_sync() > LAUNCH_SYNC_INTERVAL and not launch_sync_lock.locked():
+        threading.Thread(target=background_sync, daemon=True).start()
+
+# /api/launches/batch limits: IDs per request, and upstream lookups in flight at once
+BATCH_MAX_IDS = 100
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+
+def parse_batch_ids(value: Optional[str]) -> List[str]:
+    # Comma separated launch IDs, duplicates dropped, order kept
+    ids = list(dict.fromkeys(launch_id.strip() for launch_id in (value or '').split(',') if launch_id.strip()))
+    if not ids:
+        raise ValueError('ids must list at least one launch ID')
+    if len(ids) > BATCH_MAX_IDS:
+        raise ValueError(f'At most {BATCH_MAX_IDS} launch IDs can be requested at once')
+    return ids
+
+def batch_response(ids: List[str], launches: Dict, errors: Dict) -> Dict:
+    # Found launches in the requested order, and why the others are missing
+    return {
+        'success': True,
+        'data': [launches[launch_id] for launch_id in ids if launch_id in launches],
+        'errors': errors
+    }
+
+def parse_query_date(value: Optional[str]) -> Optional[str]:
+    # ISO date or datetime -> UTC text in the same format as the stored 'net' values
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%SZ')
 
 # Flask Routes
 @app.route('/')
@@ -62,66 +285,21 @@ def index():
 
 @app.route('/api/latest')
 def get_latest_launch():
-    # Get latest SpaceX launch from Launch Library 2 API
+    # Get latest SpaceX launch, the newest one in the local launch store
     try:
-        url = "https://ll.thespacedevs.com/2.2.0/launch/previous/?format=json&limit=50&search=SpaceX&net__lt=2024-12-31T23:59:59Z"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
+        ensure_launches_synced()
+        launches = launch_store.query(limit=1)
         
-        if data.get('results') and len(data['results']) > 0:
-            # Filter for past launches only
-            current_time = datetime.now()
-            past_launches = []
-            
-            for launch in data['results']:
-                launch_date_str = launch.get('net', '')
-                if launch_date_str:
-                    try:
-                        launch_date = datetime.fromisoformat(launch_date_str.replace('Z', '+00:00'))
-                        if launch_date < current_time:
-                            past_launches.append(launch)
-                    except:
-                        # If date parsing fails, include it (might be a different format)
-                        past_launches.append(launch)
-            
-            if not past_launches:
-                return jsonify({
-                    'success': False,
-                    'error': 'No past SpaceX launches found'
-                }), 404
-                
-            launch = past_launches[0]
-            
-            # Convert to SpaceX API format for compatibility
-            status_name = launch.get('status', {}).get('name', '').lower()
-            is_successful = 'success' in status_name or 'successful' in status_name
-            
-            formatted_launch = {
-                'id': str(launch.get('id', '')),
-                'name': launch.get('name', 'Unknown Mission'),
-                'date_utc': launch.get('net', ''),
-                'success': is_successful,
-                'flight_number': launch.get('launch_service_provider', {}).get('id', 0),
-                'details': launch.get('mission', {}).get('description', ''),
-                'links': {
-                    'webcast': launch.get('vidURLs', [{}])[0].get('url', '') if launch.get('vidURLs') else '',
-                    'article': launch.get('infoURLs', [{}])[0].get('url', '') if launch.get('infoURLs') else '',
-                    'wikipedia': launch.get('infoURLs', [{}])[1].get('url', '') if len(launch.get('infoURLs', [])) > 1 else ''
-                },
-                'cores': []  # Launch Library doesn't have core data
-            }
-            
-            return jsonify({
-                'success': True,
-                'data': formatted_launch
-            })
-        else:
+        if not launches:
             return jsonify({
                 'success': False,
-                'error': 'No recent SpaceX launches found'
+                'error': 'No past SpaceX launches found'
             }), 404
+        
+        return with_cache_status(jsonify({
+            'success': True,
+            'data': launches[0]
+        }), 'STORE')
     except Exception as e:
         return jsonify({
             'success': False,
@@ -130,37 +308,22 @@ def get_latest_launch():
 
 @app.route('/api/launch/<launch_id>')
 def get_launch_by_id(launch_id):
-    # Get specific launch by ID from Launch Library 2 API
+    # Get specific launch by ID from the launch store, or Launch Library 2 for launches it doesn't hold
     try:
-        url = f"https://ll.thespacedevs.com/2.2.0/launch/{launch_id}/?format=json"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        launch = response.json()
+        ensure_launches_synced()
+        launch = launch_store.get(launch_id)
+        if launch is not None:
+            return with_cache_status(jsonify({
+                'success': True,
+                'data': launch
+            }), 'STORE')
         
-        # Convert to SpaceX API format for compatibility
-        status_name = launch.get('status', {}).get('name', '').lower()
-        is_successful = 'success' in status_name or 'successful' in status_name
+        launch, cache_status = cached_json(launch_url(launch_id))
         
-        formatted_launch = {
-            'id': str(launch.get('id', '')),
-            'name': launch.get('name', 'Unknown Mission'),
-            'date_utc': launch.get('net', ''),
-            'success': is_successful,
-            'flight_number': launch.get('launch_service_provider', {}).get('id', 0),
-            'details': launch.get('mission', {}).get('description', ''),
-            'links': {
-                'webcast': launch.get('vidURLs', [{}])[0].get('url', '') if launch.get('vidURLs') else '',
-                'article': launch.get('infoURLs', [{}])[0].get('url', '') if launch.get('infoURLs') else '',
-                'wikipedia': launch.get('infoURLs', [{}])[1].get('url', '') if len(launch.get('infoURLs', [])) > 1 else ''
-            },
-            'cores': []  # Launch Library doesn't have core data
-        }
-        
-        return jsonify({
+        return with_cache_status(jsonify({
             'success': True,
-            'data': formatted_launch
-        })
+            'data': format_launch(launch)
+        }), cache_status)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -169,72 +332,94 @@ def get_launch_by_id(launch_id):
 
 @app.route('/api/launches')
 def get_all_launches():
-    # Get recent SpaceX launches from Launch Library 2 API
+    # Get past SpaceX launches from the launch store, newest first. Optional filters:
+    # start/end (ISO date or datetime, end exclusive), status (e.g. Success, Failure),
+    # search (part of the name), limit and offset
     try:
-        url = "https://ll.thespacedevs.com/2.2.0/launch/previous/?format=json&limit=50&search=SpaceX&net__lt=2024-12-31T23:59:59Z"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if data.get('results'):
-            # Filter for past launches only
-            current_time = datetime.now()
-            past_launches = []
-            
-            for launch in data['results']:
-                launch_date_str = launch.get('net', '')
-                if launch_date_str:
-                    try:
-                        launch_date = datetime.fromisoformat(launch_date_str.replace('Z', '+00:00'))
-                        if launch_date < current_time:
-                            past_launches.append(launch)
-                    except:
-                        # If date parsing fails, include it (might be a different format)
-                        past_launches.append(launch)
-            
-            if not past_launches:
-                return jsonify({
-                    'success': False,
-                    'error': 'No past SpaceX launches found'
-                }), 404
-                
-            launches = []
-            for launch in past_launches:
-                # Convert to SpaceX API format for compatibility
-                status_name = launch.get('status', {}).get('name', '').lower()
-                is_successful = 'success' in status_name or 'successful' in status_name
-                
-                formatted_launch = {
-                    'id': str(launch.get('id', '')),
-                    'name': launch.get('name', 'Unknown Mission'),
-                    'date_utc': launch.get('net', ''),
-                    'success': is_successful,
-                    'flight_number': launch.get('launch_service_provider', {}).get('id', 0),
-                    'details': launch.get('mission', {}).get('description', ''),
-                    'links': {
-                        'webcast': launch.get('vidURLs', [{}])[0].get('url', '') if launch.get('vidURLs') else '',
-                        'article': launch.get('infoURLs', [{}])[0].get('url', '') if launch.get('infoURLs') else '',
-                        'wikipedia': launch.get('infoURLs', [{}])[1].get('url', '') if len(launch.get('infoURLs', [])) > 1 else ''
-                    },
-                    'cores': []  # Launch Library doesn't have core data
-                }
-                launches.append(formatted_launch)
-            
-            return jsonify({
-                'success': True,
-                'data': launches
-            })
-        else:
+        start = parse_query_date(request.args.get('start'))
+        end = parse_query_date(request.args.get('end'))
+        limit = min(max(int(request.args.get('limit', DEFAULT_QUERY_LIMIT)), 1), MAX_QUERY_LIMIT)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query parameter: {str(e)}'
+        }), 400
+    
+    try:
+        ensure_launches_synced()
+        if launch_store.count() == 0:
             return jsonify({
                 'success': False,
                 'error': 'No SpaceX launches found'
             }), 404
+        
+        launches = launch_store.query(start, end, request.args.get('status'), request.args.get('search'),
+                                      limit, offset)
+        
+        return with_cache_status(jsonify({
+            'success': True,
+            'data': launches
+        }), 'STORE')
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Server error: {str(e)}'
+        }), 500
+
+@app.route('/api/launches/batch')
+def get_launches_batch():
+    # Get many launches by ID at once: stored ones locally, the rest from Launch Library
+    # with at most BATCH_CONCURRENCY lookups in flight
+    try:
+        ids = parse_batch_ids(request.args.get('ids'))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    try:
+        ensure_launches_synced()
+        launches, errors, statuses = {}, {}, []
+        for launch_id in ids:
+            launch = launch_store.get(launch_id)
+            if launch is not None:
+                launches[launch_id] = launch
+        
+        missing = [launch_id for launch_id in ids if launch_id not in launches]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(missing))) as executor:
+                futures = {launch_id: executor.submit(cached_json, launch_url(launch_id)) for launch_id in missing}
+                for launch_id, future in futures.items():
+                    try:
+                        launch, cache_status = future.result()
+                        launches[launch_id] = format_launch(launch)
+                        statuses.append(cache_status)
+                    except Exception as e:
+                        errors[launch_id] = f'Launch not found: {str(e)}'
+        
+        return with_cache_status(jsonify(batch_response(ids, launches, errors)), combined_cache_status(statuses))
     except Exception as e:
         return jsonify({
             'success': False,
             'error': f'Server error: {str(e)}'
         }), 500
 
+@app.route('/api/metrics')
+def get_metrics():
+    # Upstream connection reuse, retries and circuit state, coalesced fetches and the launch store size
+    return jsonify({
+        'success': True,
+        'data': {
+            'upstream': upstream_client.stats(),
+            'upstream_coalescing': upstream_flights.stats(),
+            'launch_store': {
+                'launches': launch_store.count(),
+                'last_sync': launch_store.last_sync()
+            }
+        }
+    })
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
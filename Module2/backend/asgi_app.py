@@ -0,0 +1,232 @@
+import asyncio
+import os
+from typing import Dict, Tuple
+from quart import Quart, render_template, request, jsonify
+
+# Launch store, cache, formatting and query helpers are shared with the Flask app
+from app import (response_cache, upstream_client, launch_store, ensure_launches_synced,
+                 format_launch, launch_url, parse_query_date, parse_batch_ids, batch_response,
+                 with_cache_status, combined_cache_status, DEFAULT_QUERY_LIMIT, MAX_QUERY_LIMIT,
+                 BATCH_CONCURRENCY, UPSTREAM_POOL_SIZE, UPSTREAM_MAX_RETRIES, UPSTREAM_BREAKER_THRESHOLD,
+                 UPSTREAM_BREAKER_RESET)
+from upstream import AsyncUpstreamClient
+
+# Asyncio serving mode: run with `hypercorn asgi_app:app` (or any ASGI server) from
+# this directory. Upstream calls don't hold a thread while they wait, so a slow
+# Launch Library only slows the requests that actually need it.
+app = Quart(__name__,
+            template_folder='../frontend',
+            static_folder='../frontend/static')
+
+async_upstream_client = AsyncUpstreamClient(pool_size=UPSTREAM_POOL_SIZE, max_retries=UPSTREAM_MAX_RETRIES,
+                                            failure_threshold=UPSTREAM_BREAKER_THRESHOLD,
+                                            reset_timeout=UPSTREAM_BREAKER_RESET)
+
+class AsyncSingleFlight:
+    # Concurrent coroutines with the same key await one task and share its result
+
+    def __init__(self):
+        self.tasks = {}
+        self.executed = 0
+        self.deduplicated = 0
+
+    async def do(self, key: str, function):
+        task = self.tasks.get(key)
+        if task is None:
+            task = self.tasks[key] = asyncio.ensure_future(function())
+            task.add_done_callback(lambda _: self.tasks.pop(key, None))
+            self.executed += 1
+        else:
+            self.deduplicated += 1
+        # A cancelled caller must not cancel the fetch the others are waiting on
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        return {
+            'in_flight': len(self.tasks),
+            'executed': self.executed,
+            'deduplicated': self.deduplicated
+        }
+
+async_flights = AsyncSingleFlight()
+background_tasks = set()
+
+async def coalesced_fetch_json(url: str) -> Dict:
+    return await async_flights.do(url, lambda: async_upstream_client.get_json(url))
+
+async def refresh(url: str):
+    try:
+        data = await coalesced_fetch_json(url)
+    except Exception as e:
+        response_cache.refresh_done(url, error=e)
+    else:
+        response_cache.refresh_done(url, data)
+
+async def cached_json(url: str) -> Tuple[Dict, str]:
+    # Same cache as the Flask app, with the refresh run as a task instead of a thread
+    data, cache_status, start_refresh = response_cache.lookup(url)
+    if start_refresh:
+        task = asyncio.ensure_future(refresh(url))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    if cache_status != 'MISS':
+        return data, cache_status
+
+    data = await coalesced_fetch_json(url)
+    response_cache.put(url, data)
+    return data, 'MISS'
+
+async def synced():
+    # The sync pages through Launch Library with the blocking client, so it runs in a thread
+    await asyncio.to_thread(ensure_launches_synced)
+
+@app.after_serving
+async def close_upstream_client():
+    await async_upstream_client.close()
+
+@app.route('/')
+async def index():
+    # Main page with SpaceX launch data
+    return await render_template('index.html')
+
+@app.route('/api/latest')
+async def get_latest_launch():
+    # Get latest SpaceX launch, the newest one in the local launch store
+    try:
+        await synced()
+        launches = launch_store.query(limit=1)
+
+        if not launches:
+            return jsonify({
+                'success': False,
+                'error': 'No past SpaceX launches found'
+            }), 404
+
+        return with_cache_status(jsonify({
+            'success': True,
+            'data': launches[0]
+        }), 'STORE')
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Server error: {str(e)}'
+        }), 500
+
+@app.route('/api/launch/<launch_id>')
+async def get_launch_by_id(launch_id):
+    # Get specific launch by ID from the launch store, or Launch Library 2 for launches it doesn't hold
+    try:
+        await synced()
+        launch = launch_store.get(launch_id)
+        if launch is not None:
+            return with_cache_status(jsonify({
+                'success': True,
+                'data': launch
+            }), 'STORE')
+
+        launch, cache_status = await cached_json(launch_url(launch_id))
+
+        return with_cache_status(jsonify({
+            'success': True,
+            'data': format_launch(launch)
+        }), cache_status)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Launch not found: {str(e)}'
+        }), 404
+
+@app.route('/api/launches')
+async def get_all_launches():
+    # Get past SpaceX launches from the launch store, with the same filters as the Flask app
+    try:
+        start = parse_query_date(request.args.get('start'))
+        end = parse_query_date(request.args.get('end'))
+        limit = min(max(int(request.args.get('limit', DEFAULT_QUERY_LIMIT)), 1), MAX_QUERY_LIMIT)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query parameter: {str(e)}'
+        }), 400
+
+    try:
+        await synced()
+        if launch_store.count() == 0:
+            return jsonify({
+                'success': False,
+                'error': 'No SpaceX launches found'
+            }), 404
+
+        launches = launch_store.query(start, end, request.args.get('status'), request.args.get('search'),
+                                      limit, offset)
+
+        return with_cache_status(jsonify({
+            'success': True,
+            'data': launches
+        }), 'STORE')
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Server error: {str(e)}'
+        }), 500
+
+@app.route('/api/launches/batch')
+async def get_launches_batch():
+    # Get many launches by ID at once: stored ones locally, the rest concurrently from
+    # Launch Library with at most BATCH_CONCURRENCY lookups in flight
+    try:
+        ids = parse_batch_ids(request.args.get('ids'))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    try:
+        await synced()
+        launches, errors, statuses = {}, {}, []
+        for launch_id in ids:
+            launch = launch_store.get(launch_id)
+            if launch is not None:
+                launches[launch_id] = launch
+
+        limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def fetch(launch_id):
+            async with limit:
+                try:
+                    launch, cache_status = await cached_json(launch_url(launch_id))
+                    launches[launch_id] = format_launch(launch)
+                    statuses.append(cache_status)
+                except Exception as e:
+                    errors[launch_id] = f'Launch not found: {str(e)}'
+
+        await asyncio.gather(*(fetch(launch_id) for launch_id in ids if launch_id not in launches))
+
+        return with_cache_status(jsonify(batch_response(ids, launches, errors)), combined_cache_status(statuses))
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Server error: {str(e)}'
+        }), 500
+
+@app.route('/api/metrics')
+async def get_metrics():
+    # Upstream stats of both clients (the blocking one only runs launch syncs here),
+    # coalesced fetches and the launch store size
+    return jsonify({
+        'success': True,
+        'data': {
+            'upstream': async_upstream_client.stats(),
+            'upstream_sync': upstream_client.stats(),
+            'upstream_coalescing': async_flights.stats(),
+            'launch_store': {
+                'launches': launch_store.count(),
+                'last_sync': launch_store.last_sync()
+            }
+        }
+    })
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', '5000')))
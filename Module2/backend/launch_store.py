@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+class LaunchStore:
+    # Normalized Launch Library launches in SQLite, indexed for local queries
+
+    def __init__(self, db_name: str = "launches.db"):
+        self.db_name = db_name
+        self.init_database()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_name)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def init_database(self):
+        conn = self.connect()
+        try:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS launches (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    net TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_launches_net ON launches (net);
+                CREATE INDEX IF NOT EXISTS idx_launches_status_net ON launches (status, net);
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def upsert(self, launches: List[Tuple[Dict, str]]):
+        # Store (formatted launch, status abbreviation) pairs, replacing earlier copies
+        conn = self.connect()
+        try:
+            conn.executemany('''
+                INSERT OR REPLACE INTO launches (id, name, net, status, data) VALUES (?, ?, ?, ?, ?)
+            ''', [(launch['id'], launch['name'], launch['date_utc'] or '', status.lower(), json.dumps(launch))
+                  for launch, status in launches])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, launch_id: str) -> Optional[Dict]:
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT data FROM launches WHERE id = ?', (launch_id,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def query(self, start: Optional[str] = None, end: Optional[str] = None, status: Optional[str] = None,
+              search: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[Dict]:
+        # Newest first. start/end are ISO dates or datetimes compared against the UTC 'net' text
+        clauses, params = [], []
+        if start:
+            clauses.append('net >= ?')
+            params.append(start)
+        if end:
+            clauses.append('net < ?')
+            params.append(end)
+        if status:
+            clauses.append('status = ?')
+            params.append(status.lower())
+        if search:
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            params.append('%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+
+        conn = self.connect()
+        try:
+            rows = conn.execute(f'''
+                SELECT data FROM launches {where}
+                ORDER BY net DESC, id LIMIT ? OFFSET ?
+            ''', params + [limit, offset]).fetchall()
+        finally:
+            conn.close()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self) -> int:
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM launches').fetchone()[0]
+        finally:
+            conn.close()
+
+    def watermark(self) -> Optional[str]:
+        # 'net' of the newest stored launch; incremental syncs start from here
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT MAX(net) FROM launches').fetchone()[0]
+        finally:
+            conn.close()
+
+    def get_state(self, key: str) -> Optional[str]:
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: str):
+        conn = self.connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def last_sync(self) -> float:
+        return float(self.get_state('last_sync') or 0)
+
+    def mark_synced(self):
+        self.set_state('last_sync', str(time.time()))
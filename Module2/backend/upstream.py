@@ -0,0 +1,236 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Only needed by the asyncio serving mode (asgi_app.py)
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Responses worth retrying: rate limited or a server-side failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    # Raised without contacting the upstream while the circuit breaker is open
+    pass
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class UpstreamPolicy:
+    # Retry, backoff and circuit breaker state shared by the blocking and asyncio clients
+
+    def __init__(self, max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 max_retry_wait: float = 30.0, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 timeout: float = 10):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_wait = max_retry_wait
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.retries = 0
+        self.circuit_opens = 0
+        self.rejected = 0
+
+    def before_request(self):
+        with self.lock:
+            now = time.monotonic()
+            if now < self.open_until:
+                self.rejected += 1
+                raise CircuitOpenError(f"Upstream unavailable, retrying in {self.open_until - now:.0f}s")
+            if self.consecutive_failures >= self.failure_threshold:
+                # Half open: this request is the trial, the others keep failing fast until it finishes
+                self.open_until = now + self.reset_timeout
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        with self.lock:
+            self.consecutive_failures += 1
+            wait = self.reset_timeout if self.consecutive_failures >= self.failure_threshold else 0.0
+            # A long Retry-After keeps every request away until the upstream said to come back
+            wait = max(wait, retry_after or 0.0)
+            if wait > 0:
+                if self.consecutive_failures == self.failure_threshold or retry_after:
+                    self.circuit_opens += 1
+                self.open_until = max(self.open_until, time.monotonic() + wait)
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter: anywhere up to the exponential delay, so retrying workers spread out
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def retry_delay(self, attempt: int, retry_after: Optional[float]) -> Optional[float]:
+        # Seconds to wait before the next attempt, or None (recording the failure) to give up
+        if attempt >= self.max_retries or (retry_after or 0.0) > self.max_retry_wait:
+            self.record_failure(retry_after)
+            return None
+        with self.lock:
+            self.retries += 1
+        return retry_after if retry_after is not None else self.backoff(attempt)
+
+    def circuit_stats(self) -> Dict:
+        with self.lock:
+            return {
+                'state': 'open' if time.monotonic() < self.open_until else 'closed',
+                'consecutive_failures': self.consecutive_failures,
+                'opens': self.circuit_opens,
+                'rejected': self.rejected
+            }
+
+class UpstreamClient(UpstreamPolicy):
+    # Keep-alive HTTP client with retries and a circuit breaker, shared by every route
+
+    def __init__(self, pool_size: int = 10, **policy):
+        super().__init__(**policy)
+        # One pool of up to pool_size open connections per host
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers.update({
+            'User-Agent': 'SpaceXLaunchTracker/1.0'
+        })
+
+    def get_json(self, url: str) -> Dict:
+        # GET and parse JSON, retrying 429/5xx and connection errors; raises on other HTTP errors
+        self.before_request()
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    # The upstream answered, even if it was a 404
+                    self.record_success()
+                    response.raise_for_status()
+                    return response.json()
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                error = requests.HTTPError(f"{response.status_code} Error for url: {url}", response=response)
+
+            delay = self.retry_delay(attempt, retry_after)
+            if delay is None:
+                raise error
+            attempt += 1
+            time.sleep(delay)
+
+    def connection_stats(self) -> Dict:
+        # Requests sent and connections opened per host; the difference went over a reused connection
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats = hosts.setdefault(pool.host, {'requests': 0, 'connections_opened': 0})
+            stats['requests'] += pool.num_requests
+            stats['connections_opened'] += pool.num_connections
+        for stats in hosts.values():
+            stats['connections_reused'] = max(stats['requests'] - stats['connections_opened'], 0)
+        return hosts
+
+    def stats(self) -> Dict:
+        return {
+            'hosts': self.connection_stats(),
+            'retries': self.retries,
+            'circuit': self.circuit_stats()
+        }
+
+class AsyncUpstreamClient(UpstreamPolicy):
+    # Non-blocking counterpart of UpstreamClient on httpx, for the asyncio serving mode
+
+    def __init__(self, pool_size: int = 10, **policy):
+        super().__init__(**policy)
+        if httpx is None:
+            raise RuntimeError('The asyncio serving mode needs httpx (pip install httpx)')
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.client = None
+        self.hosts = {}
+
+    def get_client(self):
+        # Created on first use, inside the server's event loop
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout,
+                                            headers={'User-Agent': 'SpaceXLaunchTracker/1.0'})
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def count_request(self, host: str):
+        stats = self.hosts.setdefault(host, {'requests': 0, 'connections_opened': 0})
+        stats['requests'] += 1
+
+        async def trace(event_name, info):
+            # httpcore reports every new TCP connection; requests without one reused the pool
+            if event_name == 'connection.connect_tcp.complete':
+                stats['connections_opened'] += 1
+        return trace
+
+    async def get_json(self, url: str) -> Dict:
+        # GET and parse JSON, retrying 429/5xx and transport errors; raises on other HTTP errors
+        self.before_request()
+        client = self.get_client()
+        host = urlparse(url).hostname
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = await client.get(url, extensions={'trace': self.count_request(host)})
+            except httpx.TransportError as e:
+                error = e
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    # The upstream answered, even if it was a 404
+                    self.record_success()
+                    response.raise_for_status()
+                    return response.json()
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                error = httpx.HTTPStatusError(f"{response.status_code} Error for url: {url}",
+                                              request=response.request, response=response)
+
+            delay = self.retry_delay(attempt, retry_after)
+            if delay is None:
+                raise error
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict:
+        hosts = {host: dict(stats, connections_reused=max(stats['requests'] - stats['connections_opened'], 0))
+                 for host, stats in self.hosts.items()}
+        return {
+            'hosts': hosts,
+            'retries': self.retries,
+            'circuit': self.circuit_stats()
+        }
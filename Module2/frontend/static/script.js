@@ -89,10 +89,10 @@ function displayLaunchData(launch) {
     document.getElementById('recentLaunches').style.display = 'none';
 }
 
-function displayRecentLaunches(launches) {
+function displayRecentLaunches(launches, title = 'Recent Launches') {
     const recentLaunchesDiv = document.getElementById('recentLaunches');
     
-    let html = '<h5><i class="fas fa-list"></i> Recent Launches</h5>';
+    let html = `<h5><i class="fas fa-list"></i> ${title}</h5>`;
     html += '<div class="row">';
     
     launches.forEach((launch, index) => {
@@ -150,13 +150,39 @@ async function loadLatestLaunch() {
     }
 }
 
+async function loadLaunchesByIds(launchIds) {
+    showLoading();
+    try {
+        // One request for all IDs; the server looks them up concurrently
+        const response = await fetch(`/api/launches/batch?ids=${launchIds.map(encodeURIComponent).join(',')}`);
+        const result = await response.json();
+        
+        if (result.success && result.data.length > 0) {
+            displayRecentLaunches(result.data, 'Launches');
+        } else {
+            const errors = Object.values(result.errors || {});
+            showError(result.error || errors[0] || 'Launches not found');
+        }
+    } catch (error) {
+        showError('Network error: ' + error.message);
+    }
+}
+
 async function loadLaunchById(launchId = null) {
     if (!launchId) {
-        launchId = document.getElementById('launchIdInput').value.trim();
-        if (!launchId) {
+        // Several comma separated IDs are fetched together
+        const launchIds = document.getElementById('launchIdInput').value.split(',')
+            .map(id => id.trim())
+            .filter(id => id);
+        if (launchIds.length === 0) {
             showError('Please enter a launch ID');
             return;
         }
+        if (launchIds.length > 1) {
+            loadLaunchesByIds(launchIds);
+            return;
+        }
+        launchId = launchIds[0];
     }
 
     showLoading();
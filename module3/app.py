@@ -1,20 +1,164 @@
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, request, render_template, jsonify, Response, stream_with_context, g, has_request_context
 import difflib
 import re
-import PyPDF2
-import io
+import json
+import hashlib
+import gzip
+import zlib
 from collections import Counter
 import math
-from nltk.stem import PorterStemmer
+import os
+import bisect
+from array import array
+import time
+import atexit
+import cProfile
+import multiprocessing
+import pickle
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from corpus_index import CorpusIndex, hash_shingles
+from phrase_matcher import find_runs_through, find_shared_runs, rolling_hashes, token_id
+from result_cache import ResultCache, make_cache_key
+from pdf_extraction import extract_pdf_text
+from jobs import JobManager, JobQueueFull
+from process_pools import server_process_context
+from metrics import MetricsRegistry, WORD_BUCKETS
+from revisions import PARAGRAPH_RESULTS_VERSION, RevisionStore, paragraph_groups
+from winnowing import FingerprintStore, fingerprint_ids
+from stem_cache import StemCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
-# Porter stemmer for full word stemming
-stemmer = PorterStemmer()
+# Archive of previously submitted documents for one-vs-corpus search
+CORPUS_DB = os.environ.get('CORPUS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus.db'))
+MAX_SEARCH_RESULTS = 50
+
+# Sentence pairs must score above this to count as a match
+SENTENCE_MATCH_THRESHOLD = 0.45
+
+# Sentence match candidates are found through the stems in at most
+# SENTENCE_INDEX_MAX_SHARE of file 2's sentences (or SENTENCE_INDEX_MIN_SENTENCES,
+# whichever is more), and must share SENTENCE_MIN_SHARED_STEMS of them
+SENTENCE_INDEX_MAX_SHARE = 0.05
+SENTENCE_INDEX_MIN_SENTENCES = 50
+SENTENCE_MIN_SHARED_STEMS = 2
+
+# Phrase matching limits: positions tried per repeated phrase, and token
+# comparisons before the matcher switches to its linear greedy pass
+PHRASE_MAX_OCCURRENCES = 32
+PHRASE_WORK_BUDGET = 2000000
+
+# Sequence score backends. 'exact' is difflib over the full characters, 'fast'
+# picks FAST_SEQUENCE_BACKEND.
+SEQUENCE_BACKENDS = ['exact', 'token', 'quick', 'chunked']
+FAST_SEQUENCE_BACKEND = 'token'
+SEQUENCE_CHUNK_CHARS = 2000
+QUICK_EXIT_RATIO = 0.25
+corpus_index = CorpusIndex(CORPUS_DB)
+
+# Winnowed fingerprints of archived documents, kept without their text so
+# submissions from earlier terms and other courses can be checked cheaply
+FINGERPRINT_DB = os.environ.get('FINGERPRINT_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fingerprints.db'))
+WINNOW_MIN_SHARED = 5
+fingerprint_store = FingerprintStore(FINGERPRINT_DB)
+
+# /compare results keyed by file hashes and scoring configuration. Bump
+# SCORING_VERSION whenever a change to the scorers alters their output.
+SCORING_VERSION = 4
+RESULT_CACHE_DB = os.environ.get('RESULT_CACHE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.db'))
+RESULT_CACHE_MEMORY_ITEMS = 64
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+result_cache = ResultCache(RESULT_CACHE_DB, RESULT_CACHE_MEMORY_ITEMS, RESULT_CACHE_MAX_BYTES)
+
+# Paragraph fingerprints of each document version and the per-paragraph results
+# they produced, so /compare/revisions only re-scores changed paragraphs
+REVISIONS_DB = os.environ.get('REVISIONS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'revisions.db'))
+REVISIONS_MAX_BYTES = 256 * 1024 * 1024
+revision_store = RevisionStore(REVISIONS_DB, REVISIONS_MAX_BYTES)
+
+# Extracted PDF text shares the result cache, keyed by the PDF's hash
+PDF_EXTRACTION_VERSION = 1
+
+# Independent stages of a comparison, in the order they are reported
+COMPARISON_STAGES = ['structural', 'lexical', 'semantic', 'sequence', 'highlighting']
+
+# Background comparison jobs: how many run at once and how many may wait
+JOB_STAGES = ['preprocessing'] + COMPARISON_STAGES
+JOB_MAX_RUNNING = 2
+JOB_MAX_PENDING = 16
+comparison_jobs = JobManager(JOB_MAX_RUNNING, JOB_MAX_PENDING, mp_context=server_process_context())
+
+# Large comparisons run their independent parts in one pool of STAGE_WORKERS
+# processes shared by every request, started from a forkserver (or spawned)
+# rather than forked from this threaded server. Below PARALLEL_MIN_WORDS (both
+# documents together) shipping the analyses to the workers costs more than it saves.
+STAGE_PARTS = ['structural', 'lexical', 'semantic', 'sequence', 'common_phrases', 'highlights']
+STAGE_WORKERS = min(os.cpu_count() or 1, len(STAGE_PARTS))
+PARALLEL_MIN_WORDS = 20000
+
+# Most documents accepted by /matrix in one request
+MAX_MATRIX_DOCUMENTS = 500
+
+# 'full' repeats the text per sentence for the original page; 'compact' sends
+# highlights as character offsets and the text only when asked for
+RESPONSE_FORMATS = ['full', 'compact']
+
+# JSON responses smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+# Per-stage latency, document size and cache metrics, served at /metrics
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram('plagiarism_stage_seconds', 'Wall time of one comparison stage')
+REQUEST_SECONDS = metrics.histogram('plagiarism_request_seconds', 'Wall time of a request by endpoint')
+DOCUMENT_WORDS = metrics.histogram('plagiarism_document_words', 'Words per analyzed document', WORD_BUCKETS)
+CACHE_LOOKUPS = metrics.counter('plagiarism_cache_lookups_total', 'Result and PDF cache lookups by outcome')
+
+# Requests slower than PROFILE_MIN_SECONDS are saved as cProfile stats in PROFILE_DIR (off when unset)
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILE_MIN_SECONDS = float(os.environ.get('PROFILE_MIN_SECONDS', '5'))
+
+# Stems of recently seen words. A worker loads STEM_CACHE_PATH on its first
+# stem and writes it back on exit, so NLTK is only imported for unseen words.
+STEM_CACHE_PATH = os.environ.get('STEM_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stems.json.gz'))
+STEM_CACHE_SIZE = int(os.environ.get('STEM_CACHE_SIZE', '100000'))
+
+# Porter stemmer for full word stemming, created on first use (importing NLTK takes over a second)
+stemmer = None
+
+def porter_stem(word):
+    global stemmer
+    if stemmer is None:
+        from nltk.stem.porter import PorterStemmer
+        stemmer = PorterStemmer()
+    return stemmer.stem(word)
+
+stem_cache = StemCache(porter_stem, STEM_CACHE_SIZE, STEM_CACHE_PATH)
+# Only the process that created the cache writes it back, never a forked child
+STEM_CACHE_OWNER = os.getpid()
+
+@atexit.register
+def save_stem_cache():
+    # Stage workers import this module too; only the server process writes the snapshot
+    if (STEM_CACHE_PATH and stem_cache.modified and os.getpid() == STEM_CACHE_OWNER
+            and multiprocessing.parent_process() is None):
+        try:
+            stem_cache.save(STEM_CACHE_PATH)
+        except OSError as e:
+            print(f"Could not save stem cache: {str(e)}")
 
 def simple_stem(word):
     """Convert word to base form using NLTK PorterStemmer"""
-    return stemmer.stem(word.lower())
+    return stem_cache.stem(word.lower())
 
 def preprocess_text(text):
     """Clean text - lowercase and remove extra spaces"""
@@ -32,20 +176,145 @@ def get_word_frequencies(text):
     stemmed_words = [simple_stem(word) for word in words]
     return Counter(stemmed_words)
 
-def analyze_structure(text):
-    """Analyze document structure - paragraphs and organization"""
-    # Split into paragraphs
+def split_paragraphs(text):
+    """Split text into paragraphs, falling back to long lines"""
     paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
     if len(paragraphs) < 2:
         paragraphs = [p.strip() for p in text.split('\n') if len(p.strip()) > 50]
+    return paragraphs
+
+def sentence_spans(text):
+    """(start, end, display_end) of every sentence in text
+    
+    start/end trim the surrounding whitespace; display_end also takes in the
+    closing punctuation, which the sentence matcher leaves out.
+    """
+    spans = []
+    start = 0
+    for end_match in re.finditer(r'[.!?]+(?:\s+|$)', text):
+        spans.append((start, end_match.start(), end_match.end()))
+        start = end_match.end()
+    spans.append((start, len(text), len(text)))
+    
+    trimmed = []
+    for start, end, display_end in spans:
+        segment = text[start:end]
+        start += len(segment) - len(segment.lstrip())
+        end -= len(segment) - len(segment.rstrip())
+        trimmed.append((start, max(start, end), display_end))
+    return trimmed
+
+def split_sentences(text):
+    """Split text into sentences long enough to compare"""
+    return [text[start:end] for start, end, _ in sentence_spans(text) if end - start > 15]
+
+class DocumentAnalysis:
+    """Tokens, stems, sentences and paragraphs of one document, built once per upload"""
+    
+    def __init__(self, text, stem_map=None, id_map=None, sentence_ngrams=None):
+        """stem_map, id_map ({word: [word ID, stem ID]}) and sentence_ngrams
+        ({segment index: [3-, 4-, 5-gram hashes]}) are reused instead of recomputed"""
+        self.text = text
+        self.processed = preprocess_text(text)
+        # Words with their character offsets, used for offset-based highlights
+        self.word_spans = [m.span() for m in re.finditer(r'\b\w+\b', text)]
+        # Repeated words share one string object
+        canonical = {}
+        self.words = [canonical.setdefault(word, word) for word in
+                      (text[start:end].lower() for start, end in self.word_spans)]
+        
+        # Stem each distinct word once, reusing stems already known (e.g. from an earlier version)
+        known = stem_map or {}
+        self.stem_map = {word: known[word] if word in known else simple_stem(word) for word in set(self.words)}
+        self.stems = [self.stem_map[word] for word in self.words]
+        self.word_frequencies = Counter(self.stems)
+        
+        # Stable integer IDs of every word and stem; n-grams and shared runs are
+        # hashed from these instead of from joined strings
+        known_ids = id_map or {}
+        word_ids = {word: known_ids[word][0] if word in known_ids else token_id(word) for word in self.stem_map}
+        stem_ids = {word: known_ids[word][1] if word in known_ids else token_id(stem)
+                    for word, stem in self.stem_map.items()}
+        self.word_ids = array('q', [word_ids[word] for word in self.words])
+        self.stem_ids = array('q', [stem_ids[word] for word in self.words])
+        
+        self.paragraphs = []
+        for para in split_paragraphs(self.processed):
+            para_words = extract_words(para)
+            self.paragraphs.append({
+                'text': para,
+                'words': para_words,
+                'stems': [self.stem(w) for w in para_words]
+            })
+        
+        # One segmentation shared by sentence matching and highlighting: every
+        # segment knows its character range and word range, and segments long
+        # enough to compare point at their entry in self.sentences
+        self.segments = []
+        self.sentences = []
+        word_starts = [start for start, _ in self.word_spans]
+        known_ngrams = sentence_ngrams or {}
+        for start, end, display_end in sentence_spans(text):
+            segment = {
+                'start': start,
+                'end': end,
+                'display_end': display_end,
+                'word_start': bisect.bisect_left(word_starts, start),
+                'word_end': bisect.bisect_left(word_starts, display_end),
+                'sentence': None
+            }
+            
+            if end - start > 15:
+                segment['sentence'] = len(self.sentences)
+                sent = text[start:end]
+                sent_ids = self.stem_ids[segment['word_start']:segment['word_end']]
+                hashes = known_ngrams.get(len(self.segments))
+                if hashes is None:
+                    hashes = [rolling_hashes(sent_ids, n) for n in [3, 4, 5]]
+                self.sentences.append({
+                    'text': sent,
+                    'start': start,
+                    'end': end,
+                    'segment': len(self.segments),
+                    'lower': sent.lower(),
+                    'stem_set': set(sent_ids),
+                    'ngrams': {n: set(ngrams) for n, ngrams in zip([3, 4, 5], hashes)}
+                })
+            
+            self.segments.append(segment)
+        
+        self._ngram_sets = {}
+    
+    def stem(self, word):
+        stem = self.stem_map.get(word)
+        if stem is None:
+            stem = self.stem_map[word] = simple_stem(word)
+        return stem
+    
+    def ngram_set(self, n, stemmed=False):
+        """Hashes of every n-word phrase in the document"""
+        key = (n, stemmed)
+        if key not in self._ngram_sets:
+            self._ngram_sets[key] = set(rolling_hashes(self.stem_ids if stemmed else self.word_ids, n))
+        return self._ngram_sets[key]
+
+def analyze_document(doc):
+    """Return a DocumentAnalysis, reusing one that was already built"""
+    if isinstance(doc, DocumentAnalysis):
+        return doc
+    return DocumentAnalysis(doc)
+
+def analyze_structure(doc):
+    """Analyze document structure - paragraphs and organization"""
+    doc = analyze_document(doc)
     
     structure = []
-    for para in paragraphs:
-        para_words = extract_words(para)
+    for para in doc.paragraphs:
+        para_words = para['words']
         if len(para_words) > 0:
             first_words = ' '.join(para_words[:5])
             length_cat = 'short' if len(para_words) < 50 else 'medium' if len(para_words) < 150 else 'long'
-            word_freq = Counter([simple_stem(w) for w in para_words])
+            word_freq = Counter(para['stems'])
             top_stem = word_freq.most_common(1)[0][0] if word_freq else ''
             
             structure.append({
@@ -87,8 +356,8 @@ def calculate_structural_similarity(structure1, structure2):
 
 def calculate_lexical_similarity(text1, text2):
     """Compare word frequency similarity"""
-    freq1 = get_word_frequencies(text1)
-    freq2 = get_word_frequencies(text2)
+    freq1 = analyze_document(text1).word_frequencies
+    freq2 = analyze_document(text2).word_frequencies
     
     if not freq1 or not freq2:
         return 0.0
@@ -117,25 +386,17 @@ def calculate_lexical_similarity(text1, text2):
 
 def calculate_semantic_similarity(text1, text2):
     """Compare semantic similarity - rephrased ideas"""
-    words1 = extract_words(text1)
-    words2 = extract_words(text2)
+    doc1 = analyze_document(text1)
+    doc2 = analyze_document(text2)
     
-    if len(words1) < 10 or len(words2) < 10:
+    if len(doc1.words) < 10 or len(doc2.words) < 10:
         return 0.0
     
     # Check n-grams (phrases of different lengths)
     similarities = []
     for n in [3, 4, 5]:
-        ngrams1 = set()
-        ngrams2 = set()
-        
-        for i in range(len(words1) - n + 1):
-            ngram = ' '.join(words1[i:i+n])
-            ngrams1.add(ngram)
-        
-        for i in range(len(words2) - n + 1):
-            ngram = ' '.join(words2[i:i+n])
-            ngrams2.add(ngram)
+        ngrams1 = doc1.ngram_set(n)
+        ngrams2 = doc2.ngram_set(n)
         
         if ngrams1 or ngrams2:
             common = len(ngrams1 & ngrams2)
@@ -144,14 +405,14 @@ def calculate_semantic_similarity(text1, text2):
                 similarities.append(common / total)
     
     # Check word sequences with stemming
-    stemmed1 = [simple_stem(w) for w in words1]
-    stemmed2 = [simple_stem(w) for w in words2]
+    stemmed1 = doc1.stem_ids
+    stemmed2 = doc2.stem_ids
     
-    common_sequences = 0
-    for i in range(min(len(stemmed1), len(stemmed2)) - 4):
-        seq1 = ' '.join(stemmed1[i:i+4])
-        if seq1 in ' '.join(stemmed2):
-            common_sequences += 1
+    # Positions whose 4-stem window appears anywhere in text 2: one pass over
+    # text 1 against the set of text 2 window hashes
+    windows2 = doc2.ngram_set(4, stemmed=True)
+    limit = min(len(stemmed1), len(stemmed2)) - 4
+    common_sequences = sum(1 for h in rolling_hashes(stemmed1, 4)[:max(limit, 0)] if h in windows2)
     
     seq_score = common_sequences / max(len(stemmed1), len(stemmed2)) if stemmed1 or stemmed2 else 0
     
@@ -160,22 +421,87 @@ def calculate_semantic_similarity(text1, text2):
     semantic_score = (avg_ngram * 0.7 + min(seq_score * 10, 1.0) * 0.3) * 100
     return semantic_score
 
-def calculate_enhanced_similarity(text1, text2):
-    """Calculate overall similarity using multiple methods"""
-    # Exact text similarity
-    sequence_ratio = difflib.SequenceMatcher(None, text1, text2).ratio()
-    sequence_score = sequence_ratio * 100
+def split_chunks(text, count):
+    """Split text into count pieces of roughly equal length at spaces"""
+    chunks = []
+    start = 0
+    for k in range(1, count + 1):
+        end = len(text) if k == count else text.find(' ', max(start, len(text) * k // count))
+        if end == -1:
+            end = len(text)
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+def calculate_sequence_ratio(text1, text2, backend='exact'):
+    """Sequence ratio (0-1) and its error bound against exact difflib (None if unknown)"""
+    doc1 = analyze_document(text1)
+    doc2 = analyze_document(text2)
     
-    # Structural analysis
-    structure1 = analyze_structure(text1)
-    structure2 = analyze_structure(text2)
-    structural_score = calculate_structural_similarity(structure1, structure2)
+    if backend == 'exact':
+        return difflib.SequenceMatcher(None, doc1.processed, doc2.processed).ratio(), 0.0
     
-    # Lexical analysis
-    lexical_score = calculate_lexical_similarity(text1, text2)
+    if backend == 'token':
+        # Same algorithm over word IDs - about 5x fewer elements than characters
+        return difflib.SequenceMatcher(None, doc1.word_ids, doc2.word_ids).ratio(), None
     
-    # Semantic analysis
-    semantic_score = calculate_semantic_similarity(text1, text2)
+    if backend == 'quick':
+        # Both quick ratios are upper bounds on the exact ratio, so a low bound
+        # is returned as-is with the bound itself as the maximum error
+        matcher = difflib.SequenceMatcher(None, doc1.processed, doc2.processed)
+        bound = matcher.real_quick_ratio()
+        if bound <= QUICK_EXIT_RATIO:
+            return bound, bound
+        bound = matcher.quick_ratio()
+        if bound <= QUICK_EXIT_RATIO:
+            return bound, bound
+        return matcher.ratio(), 0.0
+    
+    if backend == 'chunked':
+        # Align equal-count chunks in order; matches across chunk borders are missed
+        total = len(doc1.processed) + len(doc2.processed)
+        if total == 0:
+            return 1.0, 0.0
+        count = max(1, math.ceil(max(len(doc1.processed), len(doc2.processed)) / SEQUENCE_CHUNK_CHARS))
+        matches = 0
+        for chunk1, chunk2 in zip(split_chunks(doc1.processed, count), split_chunks(doc2.processed, count)):
+            matcher = difflib.SequenceMatcher(None, chunk1, chunk2)
+            matches += sum(block.size for block in matcher.get_matching_blocks())
+        return 2.0 * matches / total, None
+    
+    raise ValueError(f"Unknown sequence backend: {backend}")
+
+def resolve_sequence_mode(mode):
+    """Map a requested sequence mode ('exact', 'fast' or a backend name) to a backend"""
+    backend = FAST_SEQUENCE_BACKEND if mode == 'fast' else mode
+    if backend not in SEQUENCE_BACKENDS:
+        raise ValueError(f"Unknown sequence mode: {mode}")
+    return backend
+
+def compare_sequence_backends(text1, text2):
+    """Run every sequence backend and report its time and error against exact difflib"""
+    doc1 = analyze_document(text1)
+    doc2 = analyze_document(text2)
+    
+    results = {}
+    for backend in SEQUENCE_BACKENDS:
+        start = time.perf_counter()
+        ratio, error_bound = calculate_sequence_ratio(doc1, doc2, backend)
+        results[backend] = {
+            'ratio': ratio,
+            'error_bound': error_bound,
+            'seconds': time.perf_counter() - start
+        }
+    
+    exact = results['exact']['ratio']
+    for result in results.values():
+        result['error'] = abs(result['ratio'] - exact)
+    return results
+
+def combine_similarity_scores(structural_score, lexical_score, semantic_score, sequence_ratio,
+                              sequence_backend='exact', sequence_error=0.0):
+    """Weight the component scores into the similarity breakdown"""
+    sequence_score = sequence_ratio * 100
     
     # Weighted combination
     final_score = (
@@ -190,301 +516,292 @@ def calculate_enhanced_similarity(text1, text2):
         'structural': round(structural_score, 2),
         'lexical': round(lexical_score, 2),
         'semantic': round(semantic_score, 2),
-        'sequence': round(sequence_score, 2)
+        'sequence': round(sequence_score, 2),
+        'sequence_backend': sequence_backend,
+        'sequence_error_bound': round(sequence_error * 100, 2) if sequence_error is not None else None
     }
 
-def find_common_phrases(text1, text2, min_length=5):
-    """Find phrases that appear in both texts"""
-    text1_lower = text1.lower()
-    text2_lower = text2.lower()
+def calculate_enhanced_similarity(text1, text2, sequence_mode='exact'):
+    """Calculate overall similarity using multiple methods"""
+    doc1 = analyze_document(text1)
+    doc2 = analyze_document(text2)
+    sequence_backend = resolve_sequence_mode(sequence_mode)
+    
+    # Exact (or approximate) text similarity
+    sequence_ratio, sequence_error = calculate_sequence_ratio(doc1, doc2, sequence_backend)
     
-    words1 = extract_words(text1_lower)
-    words2 = extract_words(text2_lower)
+    # Structural analysis
+    structure1 = analyze_structure(doc1)
+    structure2 = analyze_structure(doc2)
+    structural_score = calculate_structural_similarity(structure1, structure2)
+    
+    # Lexical analysis
+    lexical_score = calculate_lexical_similarity(doc1, doc2)
+    
+    # Semantic analysis
+    semantic_score = calculate_semantic_similarity(doc1, doc2)
+    
+    return combine_similarity_scores(structural_score, lexical_score, semantic_score,
+                                     sequence_ratio, sequence_backend, sequence_error)
+
+def find_common_phrases(text1, text2, min_length=5, max_phrases=20):
+    """Find phrases that appear in both texts"""
+    doc1 = analyze_document(text1)
+    doc2 = analyze_document(text2)
     
     common_phrases = []
     seen_phrases = set()
     
-    # Check multiple phrase lengths
-    for phrase_len in [min_length, min_length+2, min_length+5]:
-        if phrase_len > len(words1) or phrase_len > len(words2):
+    # Verbatim phrases of a few fixed lengths, then phrases that only match after
+    # stemming. Each length is one pass of text 1 window hashes against the set
+    # of text 2 window hashes, stopping as soon as max_phrases are found.
+    passes = [(n, False) for n in [min_length, min_length+2, min_length+5]] + [(4, True), (6, True)]
+    for n, stemmed in passes:
+        windows2 = doc2.ngram_set(n, stemmed=stemmed)
+        if not windows2:
             continue
         
-        # Build phrase dictionary from text2 for fast lookup
-        phrases2_dict = {}
-        for j in range(len(words2) - phrase_len + 1):
-            phrase2 = ' '.join(words2[j:j+phrase_len])
-            if phrase2 not in phrases2_dict:
-                phrases2_dict[phrase2] = []
-            phrases2_dict[phrase2].append(j)
-        
-        # Check phrases from text1
-        for i in range(len(words1) - phrase_len + 1):
-            phrase1 = ' '.join(words1[i:i+phrase_len])
-            
-            if phrase1 in phrases2_dict:
-                original_words = extract_words(text1)
-                if i < len(original_words) and i+phrase_len <= len(original_words):
-                    original_phrase = ' '.join(original_words[i:i+phrase_len])
-                    phrase_key = phrase1.lower()
-                    
-                    if phrase_key not in seen_phrases:
-                        seen_phrases.add(phrase_key)
-                        common_phrases.append(original_phrase)
-        
-        if len(common_phrases) >= 20:
-            break
-    
-    # Also check with stemming for semantic overlap
-    stemmed1 = [simple_stem(w) for w in words1]
-    stemmed2 = [simple_stem(w) for w in words2]
-    
-    for phrase_len in [4, 6]:
-        if phrase_len > len(stemmed1) or phrase_len > len(stemmed2):
-            continue
-        
-        stem_phrases2 = set()
-        for j in range(len(stemmed2) - phrase_len + 1):
-            stem_phrase = ' '.join(stemmed2[j:j+phrase_len])
-            stem_phrases2.add(stem_phrase)
-        
-        for i in range(len(stemmed1) - phrase_len + 1):
-            stem_phrase1 = ' '.join(stemmed1[i:i+phrase_len])
-            
-            if stem_phrase1 in stem_phrases2:
-                original_words = extract_words(text1)
-                if i < len(original_words) and i+phrase_len <= len(original_words):
-                    original_phrase = ' '.join(original_words[i:i+phrase_len])
-                    phrase_key = stem_phrase1.lower()
-                    
-                    if phrase_key not in seen_phrases:
-                        seen_phrases.add(phrase_key)
-                        common_phrases.append(original_phrase)
-    
-    return common_phrases[:20]
-
-def find_matching_sections(text1, text2):
-    """Find matching sentences between texts"""
-    sentences1 = re.split(r'[.!?]+(?:\s+|$)', text1)
-    sentences2 = re.split(r'[.!?]+(?:\s+|$)', text2)
-    
-    sentences1 = [s.strip() for s in sentences1 if len(s.strip()) > 15]
-    sentences2 = [s.strip() for s in sentences2 if len(s.strip()) > 15]
+        for i, h in enumerate(rolling_hashes(doc1.stem_ids if stemmed else doc1.word_ids, n)):
+            if h not in windows2:
+                continue
+            phrase_key = ' '.join((doc1.stems if stemmed else doc1.words)[i:i+n])
+            if phrase_key not in seen_phrases:
+                seen_phrases.add(phrase_key)
+                common_phrases.append(' '.join(doc1.words[i:i+n]))
+                if len(common_phrases) >= max_phrases:
+                    return common_phrases
+    
+    return common_phrases
+
+def sentence_ngram_similarity(sent1, sent2):
+    """Best Jaccard overlap of stemmed 3, 4 and 5-grams between two sentences"""
+    ngram_sim = 0
+    for n in [3, 4, 5]:
+        common_ngrams = sent1['ngrams'][n] & sent2['ngrams'][n]
+        if common_ngrams:
+            all_ngrams = len(sent1['ngrams'][n]) + len(sent2['ngrams'][n]) - len(common_ngrams)
+            ngram_sim = max(ngram_sim, len(common_ngrams) / all_ngrams)
+    return ngram_sim
+
+def find_matching_sections(text1, text2, known_matches=None):
+    """Find matching sentences between texts
+    
+    known_matches maps file 1 sentence indexes whose result is already known (from
+    an earlier version scored against the same file 2) to [file2_index, similarity],
+    or None when the sentence had no match; those sentences are not scored again.
+    """
+    sentences1 = analyze_document(text1).sentences
+    sentences2 = analyze_document(text2).sentences
+    
+    # Inverted index from each stem to the file 2 sentences that contain it.
+    # Stems found in many sentences (function words) say little about a match
+    # and would make almost every sentence a candidate, so candidates are only
+    # looked up through the rarer ones.
+    stem_index = {}
+    for j, sent2 in enumerate(sentences2):
+        for stem in sent2['stem_set']:
+            stem_index.setdefault(stem, []).append(j)
+    max_sentences = max(SENTENCE_INDEX_MAX_SHARE * len(sentences2), SENTENCE_INDEX_MIN_SENTENCES)
+    rare_index = {stem: js for stem, js in stem_index.items() if len(js) <= max_sentences}
     
     matching_pairs = []
     
     for i, sent1 in enumerate(sentences1):
-        sent1_lower = sent1.lower()
-        sent1_words = extract_words(sent1)
-        sent1_stemmed = [simple_stem(w) for w in sent1_words]
+        if known_matches is not None and i in known_matches:
+            known = known_matches[i]
+            if known is not None:
+                matching_pairs.append({
+                    'file1_sentence': sent1['text'],
+                    'file2_sentence': sentences2[known[0]]['text'],
+                    'similarity': known[1],
+                    'file1_index': i,
+                    'file2_index': known[0]
+                })
+            continue
+        
+        # Candidates are sentences sharing at least SENTENCE_MIN_SHARED_STEMS rare
+        # stems (or all the sentence has). This is a heuristic: a pair sharing only
+        # common words can still pass the threshold and is missed. Sentences made
+        # of common words alone are looked up through every stem; a pair with no
+        # shared stems scores at most 0.4 (sequence only) and can never pass.
+        rare_stems = [stem for stem in sent1['stem_set'] if stem in rare_index]
+        index = rare_index if rare_stems else stem_index
+        shared_counts = Counter()
+        for stem in rare_stems or sent1['stem_set']:
+            for j in index[stem] if stem in index else ():
+                shared_counts[j] += 1
+        required = min(SENTENCE_MIN_SHARED_STEMS, len(rare_stems)) or 1
+        
+        candidates = []
+        for j, rare_shared in shared_counts.items():
+            if rare_shared < required:
+                continue
+            shared = len(sent1['stem_set'] & sentences2[j]['stem_set'])
+            all_words = len(sent1['stem_set']) + len(sentences2[j]['stem_set']) - shared
+            candidates.append((shared / all_words, j))
+        # Strongest word overlap first so the bounds below prune early
+        candidates.sort(key=lambda c: (-c[0], c[1]))
         
         best_match = None
         best_similarity = 0
+        best_index = len(sentences2)
         
-        for j, sent2 in enumerate(sentences2):
-            sent2_lower = sent2.lower()
-            sent2_words = extract_words(sent2)
-            sent2_stemmed = [simple_stem(w) for w in sent2_words]
+        for word_sim, j in candidates:
+            sent2 = sentences2[j]
+            floor = max(best_similarity, SENTENCE_MATCH_THRESHOLD)
             
-            # Method 1: Sequence similarity
-            seq_sim = difflib.SequenceMatcher(None, sent1_lower, sent2_lower).ratio()
+            # Upper bound with perfect sequence and n-gram scores
+            if (1.0 * 0.4 + word_sim * 0.4 + 1.0 * 0.2) < floor:
+                break
             
-            # Method 2: Word overlap
-            common_words = set(sent1_stemmed) & set(sent2_stemmed)
-            all_words = set(sent1_stemmed) | set(sent2_stemmed)
-            word_sim = len(common_words) / len(all_words) if all_words else 0
+            ngram_sim = sentence_ngram_similarity(sent1, sent2)
+            if (1.0 * 0.4 + word_sim * 0.4 + ngram_sim * 0.2) < floor:
+                continue
             
-            # Method 3: N-gram matching
-            ngram_sim = 0
-            for n in [3, 4, 5]:
-                ngrams1 = [' '.join(sent1_stemmed[k:k+n]) for k in range(len(sent1_stemmed)-n+1)]
-                ngrams2 = [' '.join(sent2_stemmed[k:k+n]) for k in range(len(sent2_stemmed)-n+1)]
-                common_ngrams = set(ngrams1) & set(ngrams2)
-                all_ngrams = set(ngrams1) | set(ngrams2)
-                if all_ngrams:
-                    ngram_ratio = len(common_ngrams) / len(all_ngrams)
-                    ngram_sim = max(ngram_sim, ngram_ratio)
+            # difflib bounds are cheap upper limits on the full ratio
+            matcher = difflib.SequenceMatcher(None, sent1['lower'], sent2['lower'])
+            if (matcher.real_quick_ratio() * 0.4 + word_sim * 0.4 + ngram_sim * 0.2) < floor:
+                continue
+            if (matcher.quick_ratio() * 0.4 + word_sim * 0.4 + ngram_sim * 0.2) < floor:
+                continue
+            seq_sim = matcher.ratio()
             
             # Combined similarity
             combined_sim = (seq_sim * 0.4 + word_sim * 0.4 + ngram_sim * 0.2)
             
-            if combined_sim > best_similarity:
+            # Ties go to the earliest file 2 sentence
+            if combined_sim > best_similarity or (combined_sim == best_similarity and j < best_index):
                 best_similarity = combined_sim
+                best_index = j
                 best_match = {
-                    'file1_sentence': sent1,
-                    'file2_sentence': sent2,
+                    'file1_sentence': sent1['text'],
+                    'file2_sentence': sent2['text'],
                     'similarity': combined_sim,
                     'file1_index': i,
                     'file2_index': j
                 }
         
-        if best_similarity > 0.45:
+        if best_similarity > SENTENCE_MATCH_THRESHOLD:
             matching_pairs.append(best_match)
     
     return matching_pairs
 
-def find_matching_phrases_in_text(text1, text2, min_length=4):
+def find_matching_phrases_in_text(text1, text2, min_length=4, work_budget=PHRASE_WORK_BUDGET):
     """Find matching phrases for highlighting"""
-    words1 = extract_words(text1.lower())
-    words2 = extract_words(text2.lower())
-    
-    # Limit processing for large files
-    MAX_WORDS = 2000
-    if len(words1) > MAX_WORDS:
-        words1 = words1[:MAX_WORDS]
-    if len(words2) > MAX_WORDS:
-        words2 = words2[:MAX_WORDS]
+    doc1 = analyze_document(text1)
+    doc2 = analyze_document(text2)
     
-    stemmed1 = [simple_stem(w) for w in words1]
-    stemmed2 = [simple_stem(w) for w in words2]
+    # Each maximal shared run of stems becomes one highlighted phrase. The whole
+    # document is always covered; large inputs only lose repeated occurrences.
+    tiles = find_shared_runs(doc1.stem_ids, doc2.stem_ids, min_length,
+                             max_occurrences=PHRASE_MAX_OCCURRENCES, work_budget=work_budget)
+    return phrases_from_tiles(doc1, doc2, tiles)
+
+def phrases_from_tiles(doc1, doc2, tiles):
+    """Matching phrase entries of shared (file 1 start, file 2 start, length) runs"""
+    words1 = doc1.words
+    words2 = doc2.words
     
     matching_phrases = []
-    seen_phrases = set()
-    
-    # Use smaller phrase lengths for performance
-    phrase_lengths = [min_length, min_length+3, min_length+6] if len(words1) < 500 else [min_length, min_length+3]
+    for i, j, n in tiles:
+        matching_phrases.append({
+            'file1_phrase': ' '.join(words1[i:i+n]),
+            'file2_phrase': ' '.join(words2[j:j+n]),
+            'file1_start': i,
+            'file1_end': i+n,
+            'file2_start': j,
+            'file2_end': j+n,
+            'similarity': 1.0,
+            'length': n
+        })
     
-    for n in phrase_lengths:
-        if n > len(stemmed1) or n > len(stemmed2):
-            continue
-        
-        # Build phrase dictionary for fast lookup
-        phrases1_dict = {}
-        for i in range(len(stemmed1) - n + 1):
-            phrase = ' '.join(stemmed1[i:i+n])
-            if phrase not in phrases1_dict:
-                phrases1_dict[phrase] = []
-            phrases1_dict[phrase].append(i)
-        
-        # Check phrases from text2 against text1
-        for j in range(len(stemmed2) - n + 1):
-            phrase2 = ' '.join(stemmed2[j:j+n])
-            
-            if phrase2 in phrases1_dict:
-                for i in phrases1_dict[phrase2]:
-                    phrase_key = (i, j, n)
-                    if phrase_key not in seen_phrases:
-                        seen_phrases.add(phrase_key)
-                        matching_phrases.append({
-                            'file1_phrase': ' '.join(words1[i:i+n]),
-                            'file2_phrase': ' '.join(words2[j:j+n]),
-                            'file1_start': i,
-                            'file1_end': i+n,
-                            'file2_start': j,
-                            'file2_end': j+n,
-                            'similarity': 1.0,
-                            'length': n
-                        })
-                        if len(matching_phrases) >= 100:
-                            return matching_phrases
-    
-    return matching_phrases[:100]
-
-def highlight_matching_text(text1, text2):
+    return matching_phrases
+
+def best_sentence_similarities(matching_pairs):
+    """Best similarity of each matched sentence, by sentence index, for both files"""
+    best1 = {}
+    best2 = {}
+    for pair in matching_pairs:
+        best1[pair['file1_index']] = max(best1.get(pair['file1_index'], 0), pair['similarity'])
+        best2[pair['file2_index']] = max(best2.get(pair['file2_index'], 0), pair['similarity'])
+    return best1, best2
+
+def highlight_matching_text(text1, text2, matching_pairs=None, matching_phrases=None):
     """Prepare text with matching sections highlighted"""
-    matching_pairs = find_matching_sections(text1, text2)
-    matching_phrases = find_matching_phrases_in_text(text1, text2, min_length=3)
-    
-    # Split texts into sentences
-    sentences1 = re.split(r'([.!?]+(?:\s+|$))', text1)
-    sentences2 = re.split(r'([.!?]+(?:\s+|$))', text2)
-    
-    words1 = extract_words(text1.lower())
-    words2 = extract_words(text2.lower())
+    doc1 = analyze_document(text1)
+    doc2 = analyze_document(text2)
     
-    # Create sentence markers
-    text1_sentence_map = {}
-    text2_sentence_map = {}
+    if matching_pairs is None:
+        matching_pairs = find_matching_sections(doc1, doc2)
+    if matching_phrases is None:
+        matching_phrases = find_matching_phrases_in_text(doc1, doc2, min_length=3)
     
-    for pair in matching_pairs:
-        sent1 = pair['file1_sentence'].lower()
-        sent2 = pair['file2_sentence'].lower()
-        
-        if sent1 not in text1_sentence_map or pair['similarity'] > text1_sentence_map[sent1]['similarity']:
-            text1_sentence_map[sent1] = pair
-        if sent2 not in text2_sentence_map or pair['similarity'] > text2_sentence_map[sent2]['similarity']:
-            text2_sentence_map[sent2] = pair
-    
-    # Create phrase position markers
-    text1_phrase_matches = {}
-    text2_phrase_matches = {}
+    # Matched sentences are known by index, so no re-matching of sentence text is needed
+    best1, best2 = best_sentence_similarities(matching_pairs)
     
+    # Phrase similarity of every word position
+    phrase_similarity1 = [0.0] * len(doc1.words)
+    phrase_similarity2 = [0.0] * len(doc2.words)
     for phrase in matching_phrases:
-        for i in range(phrase['file1_start'], min(phrase['file1_end'], len(words1))):
-            if i not in text1_phrase_matches or phrase['similarity'] > text1_phrase_matches[i]:
-                text1_phrase_matches[i] = phrase['similarity']
-        
-        for j in range(phrase['file2_start'], min(phrase['file2_end'], len(words2))):
-            if j not in text2_phrase_matches or phrase['similarity'] > text2_phrase_matches[j]:
-                text2_phrase_matches[j] = phrase['similarity']
+        for i in range(phrase['file1_start'], phrase['file1_end']):
+            phrase_similarity1[i] = max(phrase_similarity1[i], phrase['similarity'])
+        for j in range(phrase['file2_start'], phrase['file2_end']):
+            phrase_similarity2[j] = max(phrase_similarity2[j], phrase['similarity'])
     
-    def create_display_with_highlights(text, sentences, words, sentence_map, phrase_matches):
+    def create_display_with_highlights(doc, best, phrase_similarity):
         """Create display with sentence and phrase highlighting"""
         display_items = []
-        word_idx = 0
         
-        for i in range(0, len(sentences)-1, 2):
-            if i+1 < len(sentences):
-                sent = (sentences[i] + sentences[i+1]).strip()
-                if len(sent) < 10:
-                    continue
-                
-                sent_lower = sent.lower()
-                sent_words = extract_words(sent_lower)
-                sent_word_count = len(sent_words)
-                
-                # Check if sentence matches
-                sentence_matched = False
-                sentence_similarity = 0
-                
-                for sent_key, pair_data in sentence_map.items():
-                    sim = difflib.SequenceMatcher(None, sent_lower, sent_key).ratio()
-                    if sim > 0.7:
-                        sentence_matched = True
-                        sentence_similarity = pair_data['similarity']
-                        break
-                
-                # Check for phrase matches
-                phrase_spans = []
-                current_span_start = None
-                current_similarity = 0
-                
-                for w in range(sent_word_count):
-                    global_word_idx = word_idx + w
-                    if global_word_idx < len(words) and global_word_idx in phrase_matches:
-                        if current_span_start is None:
-                            current_span_start = w
-                            current_similarity = phrase_matches[global_word_idx]
-                        else:
-                            current_similarity = max(current_similarity, phrase_matches[global_word_idx])
+        for segment in doc.segments:
+            sent = doc.text[segment['start']:segment['display_end']].strip()
+            if len(sent) < 10:
+                continue
+            
+            sentence_index = segment['sentence']
+            sentence_matched = sentence_index in best
+            sentence_similarity = best[sentence_index] if sentence_matched else 0
+            
+            # Phrase spans as word positions within the sentence
+            phrase_spans = []
+            current_span_start = None
+            current_similarity = 0
+            word_start = segment['word_start']
+            
+            for w in range(word_start, segment['word_end']):
+                if phrase_similarity[w] > 0:
+                    if current_span_start is None:
+                        current_span_start = w - word_start
+                        current_similarity = phrase_similarity[w]
                     else:
-                        if current_span_start is not None:
-                            phrase_spans.append({
-                                'start': current_span_start,
-                                'end': w,
-                                'similarity': current_similarity
-                            })
-                            current_span_start = None
-                
-                if current_span_start is not None:
+                        current_similarity = max(current_similarity, phrase_similarity[w])
+                elif current_span_start is not None:
                     phrase_spans.append({
                         'start': current_span_start,
-                        'end': sent_word_count,
+                        'end': w - word_start,
                         'similarity': current_similarity
                     })
-                
-                display_items.append({
-                    'text': sent + ' ',
-                    'matched': sentence_matched,
-                    'similarity': sentence_similarity,
-                    'phrase_spans': phrase_spans
+                    current_span_start = None
+            
+            if current_span_start is not None:
+                phrase_spans.append({
+                    'start': current_span_start,
+                    'end': segment['word_end'] - word_start,
+                    'similarity': current_similarity
                 })
-                
-                word_idx += sent_word_count
+            
+            display_items.append({
+                'text': sent + ' ',
+                'matched': sentence_matched,
+                'similarity': sentence_similarity,
+                'phrase_spans': phrase_spans,
+                'start': segment['start'],
+                'end': segment['display_end']
+            })
         
         return display_items
     
-    display1 = create_display_with_highlights(text1, sentences1, words1, text1_sentence_map, text1_phrase_matches)
-    display2 = create_display_with_highlights(text2, sentences2, words2, text2_sentence_map, text2_phrase_matches)
+    display1 = create_display_with_highlights(doc1, best1, phrase_similarity1)
+    display2 = create_display_with_highlights(doc2, best2, phrase_similarity2)
     
     return {
         'file1_sentences': display1,
@@ -493,23 +810,112 @@ def highlight_matching_text(text1, text2):
         'phrases': matching_phrases[:50]
     }
 
-def extract_text_from_pdf(file):
+def merge_ranges(ranges):
+    """Merge overlapping or touching [start, end] ranges"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def compact_highlights(text1, text2, matching_pairs=None, matching_phrases=None):
+    """Matched sentences and phrases as character offset ranges into each text"""
+    doc1 = analyze_document(text1)
+    doc2 = analyze_document(text2)
+    
+    if matching_pairs is None:
+        matching_pairs = find_matching_sections(doc1, doc2)
+    if matching_phrases is None:
+        matching_phrases = find_matching_phrases_in_text(doc1, doc2, min_length=3)
+    best1, best2 = best_sentence_similarities(matching_pairs)
+    
+    def sentence_ranges(doc, best):
+        return [[doc.sentences[k]['start'], doc.sentences[k]['end'], round(sim, 4)]
+                for k, sim in sorted(best.items())]
+    
+    def phrase_ranges(doc, key):
+        return merge_ranges([doc.word_spans[phrase[key + '_start']][0], doc.word_spans[phrase[key + '_end'] - 1][1]]
+                            for phrase in matching_phrases)
+    
+    return {
+        'file1': {'sentences': sentence_ranges(doc1, best1), 'phrases': phrase_ranges(doc1, 'file1')},
+        'file2': {'sentences': sentence_ranges(doc2, best2), 'phrases': phrase_ranges(doc2, 'file2')},
+        'matches': [[pair['file1_index'], pair['file2_index'], round(pair['similarity'], 4)]
+                    for pair in matching_pairs]
+    }
+
+def record_stage_time(stage, elapsed):
+    metrics.observe(STAGE_SECONDS, elapsed, stage=stage)
+    if has_request_context():
+        timings = g.setdefault('timings', {})
+        timings[stage] = round(timings.get(stage, 0) + elapsed, 6)
+
+@contextmanager
+def timed(stage):
+    """Record the wall time of a stage in the metrics and in the request's debug timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage_time(stage, time.perf_counter() - start)
+
+def record_cache_lookup(cache, hit):
+    result = 'hit' if hit else 'miss'
+    metrics.observe(CACHE_LOOKUPS, cache=cache, result=result)
+    if has_request_context():
+        g.setdefault('cache_lookups', []).append(f'{cache}:{result}')
+
+def record_documents(*docs):
+    for doc in docs:
+        metrics.observe(DOCUMENT_WORDS, len(doc.words))
+    if has_request_context():
+        g.document_words = [len(doc.words) for doc in docs]
+
+def debug_requested():
+    return request.values.get('debug', '').lower() in ('1', 'true', 'yes')
+
+def debug_timings():
+    """Stage timings, cache lookups and document sizes recorded so far in this request"""
+    return {
+        'stages': g.get('timings', {}),
+        'cache_lookups': g.get('cache_lookups', []),
+        'document_words': g.get('document_words'),
+        'elapsed': round(time.perf_counter() - g.request_start, 6)
+    }
+
+def hash_upload(file):
+    """SHA-256 of an uploaded file, leaving the stream at the start"""
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.stream.read(1 << 16), b''):
+        digest.update(block)
+    file.stream.seek(0)
+    return digest.hexdigest()
+
+def extract_text_from_pdf(file, content_hash=None):
     """Extract text from PDF file"""
     try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file.read()))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
+        # The same PDF is only ever parsed once
+        cache_key = make_cache_key(pdf=content_hash or hash_upload(file), version=PDF_EXTRACTION_VERSION)
+        cached = result_cache.get(cache_key)
+        record_cache_lookup('pdf', cached is not None)
+        if cached is not None:
+            return json.loads(cached)
+        
+        with timed('pdf_extraction'):
+            text = extract_pdf_text(file.stream)
+        result_cache.put(cache_key, json.dumps(text))
         return text
     except Exception as e:
         raise Exception(f"Error reading PDF: {str(e)}")
 
-def read_file_content(file):
+def read_file_content(file, content_hash=None):
     """Read content from file - handles text and PDF"""
     filename = file.filename.lower()
     
     if filename.endswith('.pdf'):
-        return extract_text_from_pdf(file)
+        return extract_text_from_pdf(file, content_hash)
     else:
         try:
             return file.read().decode('utf-8')
@@ -517,6 +923,475 @@ def read_file_content(file):
             file.seek(0)
             return file.read().decode('latin-1')
 
+def upload_kind(file):
+    """How an upload will be parsed - the same bytes read differently as PDF and text"""
+    return 'pdf' if file.filename.lower().endswith('.pdf') else 'text'
+
+def highlight_with_fallback(doc1, doc2, matching_pairs=None, matching_phrases=None):
+    """Highlighted matching sections, or the plain start of each text if highlighting fails"""
+    try:
+        return highlight_matching_text(doc1, doc2, matching_pairs, matching_phrases)
+    except Exception as e:
+        print(f"Error in highlight_matching_text: {str(e)}")
+        return {
+            'file1_sentences': [{'text': doc1.text[:200] + '...', 'matched': False, 'similarity': 0}],
+            'file2_sentences': [{'text': doc2.text[:200] + '...', 'matched': False, 'similarity': 0}],
+            'matches': [],
+            'phrases': []
+        }
+
+def run_comparison_stage(stage, doc1, doc2, sequence_mode='exact', response_format='full', matching_pairs=None,
+                         matching_phrases=None):
+    """Compute one independent stage of a comparison (safe to run in a worker process)
+    
+    matching_pairs and matching_phrases, when given, are the sentence and phrase
+    matches the highlighting stage would find.
+    """
+    if stage == 'structural':
+        return calculate_structural_similarity(analyze_structure(doc1), analyze_structure(doc2))
+    if stage == 'lexical':
+        return calculate_lexical_similarity(doc1, doc2)
+    if stage == 'semantic':
+        return calculate_semantic_similarity(doc1, doc2)
+    if stage == 'sequence':
+        return calculate_sequence_ratio(doc1, doc2, resolve_sequence_mode(sequence_mode))
+    if stage == 'highlighting':
+        return merge_highlighting(find_common_phrases(doc1, doc2),
+                                  run_highlights(doc1, doc2, response_format, matching_pairs, matching_phrases),
+                                  response_format)
+    raise ValueError(f"Unknown comparison stage: {stage}")
+
+def run_highlights(doc1, doc2, response_format='full', matching_pairs=None, matching_phrases=None):
+    if response_format == 'compact':
+        return compact_highlights(doc1, doc2, matching_pairs, matching_phrases)
+    return highlight_with_fallback(doc1, doc2, matching_pairs, matching_phrases)
+
+def merge_highlighting(common_phrases, highlights, response_format='full'):
+    """The highlighting stage result from its two independent parts"""
+    return {
+        'common_phrases': common_phrases,
+        'highlights' if response_format == 'compact' else 'matching_sections': highlights
+    }
+
+_stage_executor = None
+_stage_executor_lock = threading.Lock()
+
+def get_stage_executor():
+    """Process pool shared by all parallel comparisons, created on first use"""
+    global _stage_executor
+    with _stage_executor_lock:
+        if _stage_executor is None:
+            _stage_executor = ProcessPoolExecutor(max_workers=STAGE_WORKERS, mp_context=server_process_context())
+        return _stage_executor
+
+def reset_stage_executor(executor):
+    # A worker died; the next comparison gets a fresh pool
+    global _stage_executor
+    with _stage_executor_lock:
+        if _stage_executor is executor:
+            _stage_executor = None
+    executor.shutdown(wait=False)
+
+@contextmanager
+def published_analyses(doc1, doc2):
+    """Path of a temporary file holding both analyses, pickled once for every worker that reads them"""
+    # The random name keeps a worker's cached copy from matching a later comparison
+    fd, path = tempfile.mkstemp(prefix=f'analyses-{uuid.uuid4().hex}-', suffix='.pickle')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((doc1, doc2), f, protocol=pickle.HIGHEST_PROTOCOL)
+        yield path
+    finally:
+        os.unlink(path)
+
+# (path, analyses) last loaded by this worker process
+_published_docs = (None, None)
+
+def load_published_analyses(path):
+    """(doc1, doc2) from published_analyses, read once per worker and comparison"""
+    global _published_docs
+    if _published_docs[0] != path:
+        with open(path, 'rb') as f:
+            _published_docs = (path, pickle.load(f))
+    return _published_docs[1]
+
+def run_stage_part(path, part, sequence_mode, response_format, matching_pairs=None, matching_phrases=None):
+    """One part of a comparison, run in a pool worker: (result, seconds spent on it)"""
+    # Parts of the same comparison landing on this worker read the analyses once
+    doc1, doc2 = load_published_analyses(path)
+    
+    start = time.perf_counter()
+    if part == 'common_phrases':
+        result = find_common_phrases(doc1, doc2)
+    elif part == 'highlights':
+        result = run_highlights(doc1, doc2, response_format, matching_pairs, matching_phrases)
+    else:
+        result = run_comparison_stage(part, doc1, doc2, sequence_mode, response_format)
+    return result, time.perf_counter() - start
+
+def use_parallel_stages(doc1, doc2):
+    return STAGE_WORKERS >= 2 and len(doc1.words) + len(doc2.words) >= PARALLEL_MIN_WORDS
+
+def iter_comparison_stages(doc1, doc2, sequence_mode='exact', response_format='full', matching_pairs=None,
+                           matching_phrases=None):
+    """Yield (stage, result) for every comparison stage as it finishes
+    
+    Small inputs run the stages one after another in this process. Large ones
+    run all parts at once in the shared stage pool, so the comparison takes
+    about as long as its slowest part when the pool is free. Either way each
+    stage's own run time is recorded under the same stage names.
+    """
+    if not use_parallel_stages(doc1, doc2):
+        for stage in COMPARISON_STAGES:
+            with timed(stage):
+                result = run_comparison_stage(stage, doc1, doc2, sequence_mode, response_format,
+                                              matching_pairs, matching_phrases)
+            yield stage, result
+        return
+    
+    executor = get_stage_executor()
+    try:
+        # Published once for the whole comparison; each part carries only the path
+        with published_analyses(doc1, doc2) as path:
+            futures = {executor.submit(run_stage_part, path, part, sequence_mode, response_format,
+                                       *((matching_pairs, matching_phrases) if part == 'highlights' else ())): part
+                       for part in STAGE_PARTS}
+            parts = {}
+            highlighting_seconds = 0.0
+            for future in as_completed(futures):
+                part = futures[future]
+                parts[part], elapsed = future.result()
+                if part in COMPARISON_STAGES:
+                    record_stage_time(part, elapsed)
+                    yield part, parts[part]
+                    continue
+                # The serial 'highlighting' stage covers both of these parts
+                highlighting_seconds += elapsed
+                if 'common_phrases' in parts and 'highlights' in parts:
+                    record_stage_time('highlighting', highlighting_seconds)
+                    yield 'highlighting', merge_highlighting(parts['common_phrases'], parts['highlights'],
+                                                             response_format)
+    except BrokenProcessPool:
+        reset_stage_executor(executor)
+        raise
+
+def run_comparison_stages(doc1, doc2, sequence_mode='exact', response_format='full', matching_pairs=None,
+                          matching_phrases=None):
+    """{stage: result} for every comparison stage"""
+    return dict(iter_comparison_stages(doc1, doc2, sequence_mode, response_format, matching_pairs, matching_phrases))
+
+def assemble_comparison(doc1, doc2, stage_results, sequence_mode='exact', response_format='full', include_text=True):
+    """Build the /compare result from the output of every stage"""
+    sequence_ratio, sequence_error = stage_results['sequence']
+    similarity_breakdown = combine_similarity_scores(
+        stage_results['structural'], stage_results['lexical'], stage_results['semantic'],
+        sequence_ratio, resolve_sequence_mode(sequence_mode), sequence_error)
+    
+    if response_format == 'compact':
+        result = {
+            'similarity': similarity_breakdown['overall'],
+            'similarity_breakdown': similarity_breakdown,
+            'common_phrases': stage_results['highlighting']['common_phrases'],
+            'highlights': stage_results['highlighting']['highlights'],
+            'text_lengths': [len(doc1.text), len(doc2.text)]
+        }
+        if include_text:
+            result['original_text1'] = doc1.text
+            result['original_text2'] = doc2.text
+        return result
+    
+    return {
+        'similarity': similarity_breakdown['overall'],
+        'similarity_breakdown': similarity_breakdown,
+        'common_phrases': stage_results['highlighting']['common_phrases'],
+        'matching_sections': stage_results['highlighting']['matching_sections'],
+        'original_text1': doc1.text,
+        'original_text2': doc2.text
+    }
+
+def compare_documents(text1, text2, sequence_mode='exact', response_format='full', include_text=True):
+    """Run every scorer on two texts and build the /compare result"""
+    # Tokenize and stem each document once for every scorer
+    with timed('preprocessing'):
+        doc1 = DocumentAnalysis(text1)
+        doc2 = DocumentAnalysis(text2)
+    record_documents(doc1, doc2)
+    
+    stage_results = run_comparison_stages(doc1, doc2, sequence_mode, response_format)
+    return assemble_comparison(doc1, doc2, stage_results, sequence_mode, response_format, include_text)
+
+def paragraph_word_ranges(doc, groups):
+    """(first word, end word, fingerprint) of each paragraph; together they cover every word"""
+    return [(doc.segments[first]['word_start'], doc.segments[end - 1]['word_end'], fingerprint)
+            for first, end, fingerprint in groups]
+
+def paragraph_results(doc, groups, matching_pairs, paragraph_phrases):
+    """Tokens, sentence hashes, sentence matches and phrases of each paragraph, as RevisionStore keeps them"""
+    best = {pair['file1_index']: [pair['file2_index'], pair['similarity']] for pair in matching_pairs}
+    results = {}
+    for (first, end, fingerprint), (word_start, word_end, _) in zip(groups, paragraph_word_ranges(doc, groups)):
+        sentences = [segment['sentence'] for segment in doc.segments[first:end] if segment['sentence'] is not None]
+        words = set(doc.words[word_start:word_end])
+        results[fingerprint] = {
+            'stems': {word: doc.stem_map[word] for word in words},
+            'ids': {word: [token_id(word), token_id(doc.stem_map[word])] for word in words},
+            'ngrams': [[list(doc.sentences[k]['ngrams'][n]) for n in [3, 4, 5]] for k in sentences],
+            'matches': [best.get(k) for k in sentences],
+            'phrases': paragraph_phrases.get(fingerprint, [])
+        }
+    return results
+
+def known_sentence_matches(doc, groups, stored):
+    """Sentence matches of the paragraphs that already have stored results"""
+    known = {}
+    for first, end, fingerprint in groups:
+        if fingerprint in stored:
+            indexes = [segment['sentence'] for segment in doc.segments[first:end] if segment['sentence'] is not None]
+            known.update(zip(indexes, stored[fingerprint]['matches']))
+    return known
+
+def stored_sentence_ngrams(spans, groups, stored):
+    """{segment index: n-gram hashes} of the sentences in paragraphs with stored results"""
+    known = {}
+    for first, end, fingerprint in groups:
+        if fingerprint in stored:
+            indexes = [k for k in range(first, end) if spans[k][1] - spans[k][0] > 15]
+            known.update(zip(indexes, stored[fingerprint]['ngrams']))
+    return known
+
+def revision_phrase_tiles(doc1, doc2, groups, stored, min_length=3):
+    """Shared phrase runs of doc1 and doc2, reusing the stored runs of unchanged paragraphs
+    
+    Returns (tiles, {fingerprint: runs relative to the paragraph} of the newly
+    searched paragraphs). Only runs strictly inside a paragraph are stored:
+    whether a run touching a paragraph's first or last word goes on depends on
+    its neighbour, so those are searched for again, from every paragraph edge,
+    along with every run through a changed paragraph. Runs are never cut, so
+    the tiles are those of find_matching_phrases_in_text.
+    """
+    ranges = paragraph_word_ranges(doc1, groups)
+    if not any(fingerprint in stored for _, _, fingerprint in ranges):
+        tiles = find_shared_runs(doc1.stem_ids, doc2.stem_ids, min_length,
+                                 max_occurrences=PHRASE_MAX_OCCURRENCES, work_budget=PHRASE_WORK_BUDGET)
+    else:
+        tiles = []
+        positions = []
+        for start, end, fingerprint in ranges:
+            if fingerprint not in stored:
+                positions.extend(range(start, end))
+            elif start < end:
+                positions.extend([start, end - 1])
+                tiles.extend((start + i, j, n) for i, j, n in stored[fingerprint]['phrases'])
+        tiles.extend(find_runs_through(doc1.stem_ids, doc2.stem_ids, positions, min_length,
+                                       max_occurrences=PHRASE_MAX_OCCURRENCES))
+    
+    # Runs strictly inside a newly searched paragraph, kept from its first occurrence
+    first_ranges = {}
+    for k, (_, _, fingerprint) in enumerate(ranges):
+        first_ranges.setdefault(fingerprint, k)
+    new_phrases = {}
+    starts = [start for start, _, _ in ranges]
+    for i, j, n in tiles:
+        k = bisect.bisect_right(starts, i) - 1
+        start, end, fingerprint = ranges[k]
+        if fingerprint not in stored and first_ranges[fingerprint] == k and start < i and i + n < end:
+            new_phrases.setdefault(fingerprint, []).append([i - start, j, n])
+    
+    # Same order as find_shared_runs reports them
+    tiles.sort()
+    return tiles, new_phrases
+
+def compare_revision(document, text1, hash1, text2, hash2, sequence_mode='exact',
+                     response_format='full', include_text=True):
+    """Compare a new version of `document` (text1) with text2, re-scoring only changed paragraphs"""
+    spans = sentence_spans(text1)
+    groups = paragraph_groups(text1, spans)
+    fingerprints = [fingerprint for _, _, fingerprint in groups]
+    
+    # Stored sentence matches and phrases only hold against the same file 2 and scoring rules
+    against = make_cache_key(file2=hash2, version=SCORING_VERSION, paragraphs=PARAGRAPH_RESULTS_VERSION)
+    previous_version, previous_fingerprints = revision_store.latest_version(document)
+    stored = revision_store.get_paragraphs(fingerprints, against)
+    
+    # Only words and sentences from changed paragraphs (and a new file 2) need
+    # stemming and hashing
+    stems_key = make_cache_key(stems=hash2, version=SCORING_VERSION)
+    cached_stems = result_cache.get(stems_key)
+    with timed('preprocessing'):
+        stem_map = {}
+        id_map = {}
+        for paragraph in stored.values():
+            stem_map.update(paragraph['stems'])
+            id_map.update(paragraph['ids'])
+        doc1 = DocumentAnalysis(text1, stem_map, id_map, stored_sentence_ngrams(spans, groups, stored))
+        doc2 = DocumentAnalysis(text2, json.loads(cached_stems) if cached_stems is not None else None)
+    record_documents(doc1, doc2)
+    if cached_stems is None:
+        result_cache.put(stems_key, json.dumps(doc2.stem_map))
+    
+    # Sentences and phrases are only matched in changed paragraphs
+    known = known_sentence_matches(doc1, groups, stored)
+    with timed('matching_sections'):
+        matching_pairs = find_matching_sections(doc1, doc2, known)
+    with timed('matching_phrases'):
+        tiles, new_phrases = revision_phrase_tiles(doc1, doc2, groups, stored)
+        matching_phrases = phrases_from_tiles(doc1, doc2, tiles)
+    
+    stage_results = run_comparison_stages(doc1, doc2, sequence_mode, response_format, matching_pairs, matching_phrases)
+    result = assemble_comparison(doc1, doc2, stage_results, sequence_mode, response_format, include_text)
+    
+    revision_store.put_paragraphs({fingerprint: paragraph for fingerprint, paragraph
+                                   in paragraph_results(doc1, groups, matching_pairs, new_phrases).items()
+                                   if fingerprint not in stored}, against)
+    version = revision_store.add_version(document, hash1, fingerprints)
+    
+    previous = set(previous_fingerprints)
+    result['revision'] = {
+        'document': document,
+        'version': version,
+        'previous_version': previous_version or None,
+        'paragraphs': len(groups),
+        'changed_paragraphs': sum(1 for fingerprint in fingerprints if fingerprint not in previous),
+        'rescored_paragraphs': len(set(fingerprints) - set(stored)),
+        'reused_sentences': len(known),
+        'scored_sentences': len(doc1.sentences) - len(known)
+    }
+    return result
+
+def analyze_pair(text1, text2):
+    return DocumentAnalysis(text1), DocumentAnalysis(text2)
+
+def run_comparison_job(executor, report, text1, text2, sequence_mode, cache_key,
+                       response_format='full', include_text=True):
+    """Background version of compare_documents, one process pool task per stage
+    
+    The analyses come back from the pool once and are published to a file once;
+    each stage task carries only its path.
+    """
+    report('preprocessing', 'running')
+    with timed('preprocessing'):
+        doc1, doc2 = executor.submit(analyze_pair, text1, text2).result()
+    record_documents(doc1, doc2)
+    report('preprocessing', 'done')
+    
+    stage_results = {}
+    with published_analyses(doc1, doc2) as path:
+        for stage in COMPARISON_STAGES:
+            report(stage, 'running')
+            stage_results[stage], elapsed = executor.submit(run_stage_part, path, stage,
+                                                            sequence_mode, response_format).result()
+            record_stage_time(stage, elapsed)
+            report(stage, 'done')
+    
+    result = assemble_comparison(doc1, doc2, stage_results, sequence_mode, response_format, include_text)
+    result_cache.put(cache_key, json.dumps(result))
+    return result
+
+def read_comparison_upload(response_format=None):
+    """Validate the two-file upload used by /compare, /compare/stream and /compare/jobs
+    
+    Returns (upload, None) on success or (None, error response).
+    """
+    if 'file1' not in request.files or 'file2' not in request.files:
+        return None, (jsonify({'error': 'Please upload both files'}), 400)
+    
+    file1 = request.files['file1']
+    file2 = request.files['file2']
+    
+    if file1.filename == '' or file2.filename == '':
+        return None, (jsonify({'error': 'Please select both files'}), 400)
+    
+    try:
+        sequence_mode = resolve_sequence_mode(request.form.get('sequence_mode', 'exact'))
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    
+    response_format = response_format or request.values.get('format', 'full')
+    if response_format not in RESPONSE_FORMATS:
+        return None, (jsonify({'error': f'Unknown response format: {response_format}'}), 400)
+    # The full format always carries the text; compact only on request
+    include_text = response_format == 'full' or request.values.get('include_text', '').lower() in ('1', 'true', 'yes')
+    
+    # Identical uploads with the same settings share one cached result
+    hash1 = hash_upload(file1)
+    hash2 = hash_upload(file2)
+    cache_key = make_cache_key(
+        file1=[hash1, upload_kind(file1)],
+        file2=[hash2, upload_kind(file2)],
+        sequence_mode=sequence_mode,
+        response_format=response_format,
+        include_text=include_text,
+        version=SCORING_VERSION
+    )
+    
+    return {
+        'file1': file1,
+        'file2': file2,
+        'hash1': hash1,
+        'hash2': hash2,
+        'sequence_mode': sequence_mode,
+        'response_format': response_format,
+        'include_text': include_text,
+        'cache_key': cache_key
+    }, None
+
+def get_document_shingles(doc):
+    """Hash the stemmed word shingles used by the corpus index"""
+    return hash_shingles(analyze_document(doc).stems)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profiler = None
+    if PROFILE_DIR:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.teardown_request
+def record_request_time(error=None):
+    # Runs once the response has been sent, including the whole of a stream
+    if 'request_start' not in g:
+        return
+    elapsed = time.perf_counter() - g.request_start
+    metrics.observe(REQUEST_SECONDS, elapsed, endpoint=request.endpoint or 'unknown')
+    
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.disable()
+        if elapsed >= PROFILE_MIN_SECONDS:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{request.endpoint}-{time.strftime('%Y%m%d-%H%M%S')}-{elapsed:.1f}s.prof")
+            profiler.dump_stats(path)
+            print(f"Slow request profile written to {path}")
+
+@app.after_request
+def compress_response(response):
+    """Brotli or gzip compress large JSON responses when the client accepts it"""
+    if (response.direct_passthrough or response.is_streamed or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    if brotli is not None and 'br' in accept_encoding:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accept_encoding:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage and request latency histograms in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """Main page"""
@@ -526,55 +1401,334 @@ def index():
 def compare():
     """Compare two text files and return similarity results"""
     try:
-        if 'file1' not in request.files or 'file2' not in request.files:
-            return jsonify({'error': 'Please upload both files'}), 400
-        
-        file1 = request.files['file1']
-        file2 = request.files['file2']
+        upload, error = read_comparison_upload()
+        if error:
+            return error
         
-        if file1.filename == '' or file2.filename == '':
-            return jsonify({'error': 'Please select both files'}), 400
+        cached = result_cache.get(upload['cache_key'])
+        record_cache_lookup('result', cached is not None)
+        if cached is not None:
+            result = json.loads(cached)
+            result['cached'] = True
+            if debug_requested():
+                result['timings'] = debug_timings()
+            response = jsonify(result)
+            response.headers['X-Cache'] = 'HIT'
+            return response
         
         # Read file contents
-        text1 = read_file_content(file1)
-        text2 = read_file_content(file2)
+        text1 = read_file_content(upload['file1'], upload['hash1'])
+        text2 = read_file_content(upload['file2'], upload['hash2'])
         
-        # Preprocess texts
-        processed_text1 = preprocess_text(text1)
-        processed_text2 = preprocess_text(text2)
+        result = compare_documents(text1, text2, upload['sequence_mode'],
+                                   upload['response_format'], upload['include_text'])
+        result_cache.put(upload['cache_key'], json.dumps(result))
         
-        # Calculate similarity with breakdown
-        similarity_breakdown = calculate_enhanced_similarity(processed_text1, processed_text2)
-        similarity_score = similarity_breakdown['overall']
-        
-        # Find common phrases
-        common_phrases = find_common_phrases(processed_text1, processed_text2)
+        result['cached'] = False
+        if debug_requested():
+            result['timings'] = debug_timings()
+        response = jsonify(result)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"Error in compare: {error_details}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+def debug_fields():
+    return {'timings': debug_timings()} if debug_requested() else {}
+
+def ndjson_line(event, **fields):
+    fields['event'] = event
+    return json.dumps(fields) + '\n'
+
+def stream_comparison(upload, text1, text2, cached=None):
+    """NDJSON events for /compare/stream, each sent as soon as it is known"""
+    if cached is not None:
+        result = json.loads(cached)
+        if upload['include_text']:
+            yield ndjson_line('texts', original_text1=result['original_text1'],
+                              original_text2=result['original_text2'])
+        yield ndjson_line('similarity', similarity=result['similarity'],
+                          similarity_breakdown=result['similarity_breakdown'])
+        yield ndjson_line('highlights', common_phrases=result['common_phrases'],
+                          highlights=result['highlights'], text_lengths=result['text_lengths'])
+        yield ndjson_line('done', cached=True, **debug_fields())
+        return
+    
+    if upload['include_text']:
+        yield ndjson_line('texts', original_text1=text1, original_text2=text2)
+    
+    with timed('preprocessing'):
+        doc1 = DocumentAnalysis(text1)
+        doc2 = DocumentAnalysis(text2)
+    record_documents(doc1, doc2)
+    stage_results = {}
+    scores = ['structural', 'lexical', 'semantic', 'sequence']
+    for stage, stage_result in iter_comparison_stages(doc1, doc2, upload['sequence_mode'], 'compact'):
+        stage_results[stage] = stage_result
+        if stage in scores:
+            yield ndjson_line('stage', stage=stage)
+            # Scores are sent as soon as all four are known, usually well before highlighting
+            if all(score in stage_results for score in scores):
+                sequence_ratio, sequence_error = stage_results['sequence']
+                breakdown = combine_similarity_scores(
+                    stage_results['structural'], stage_results['lexical'], stage_results['semantic'],
+                    sequence_ratio, upload['sequence_mode'], sequence_error)
+                yield ndjson_line('similarity', similarity=breakdown['overall'], similarity_breakdown=breakdown)
+    
+    result = assemble_comparison(doc1, doc2, stage_results, upload['sequence_mode'], 'compact', upload['include_text'])
+    result_cache.put(upload['cache_key'], json.dumps(result))
+    yield ndjson_line('highlights', common_phrases=result['common_phrases'],
+                      highlights=result['highlights'], text_lengths=result['text_lengths'])
+    yield ndjson_line('done', cached=False, **debug_fields())
+
+def gzip_stream(chunks):
+    """Gzip a stream chunk by chunk, flushing so each line arrives immediately"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+@app.route('/compare/stream', methods=['POST'])
+def compare_stream():
+    """Compact comparison streamed as NDJSON events so the page can render progressively"""
+    try:
+        upload, error = read_comparison_upload(response_format='compact')
+        if error:
+            return error
         
-        # Get highlighted matching sections
+        # Uploads are read before streaming starts, while the request is still open
+        text1 = text2 = None
+        cached = result_cache.get(upload['cache_key'])
+        record_cache_lookup('result', cached is not None)
+        if cached is None:
+            text1 = read_file_content(upload['file1'], upload['hash1'])
+            text2 = read_file_content(upload['file2'], upload['hash2'])
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"Error in compare_stream: {error_details}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+    
+    def generate():
         try:
-            matching_sections = highlight_matching_text(text1, text2)
+            for line in stream_comparison(upload, text1, text2, cached):
+                yield line
         except Exception as e:
-            print(f"Error in highlight_matching_text: {str(e)}")
-            matching_sections = {
-                'file1_sentences': [{'text': text1[:200] + '...', 'matched': False, 'similarity': 0}],
-                'file2_sentences': [{'text': text2[:200] + '...', 'matched': False, 'similarity': 0}],
-                'matches': [],
-                'phrases': []
-            }
+            import traceback
+            print(f"Error in compare_stream: {traceback.format_exc()}")
+            yield ndjson_line('error', error=f'An error occurred: {str(e)}')
+    
+    events = stream_with_context(generate())
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = Response(gzip_stream(events), mimetype='application/x-ndjson')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(events, mimetype='application/x-ndjson')
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/compare/revisions', methods=['POST'])
+def compare_revisions():
+    """Compare a revised version of a document, reusing results for unchanged paragraphs"""
+    try:
+        document = request.form.get('document', '').strip()
+        if not document:
+            return jsonify({'error': 'Please give the document name the versions belong to'}), 400
+        
+        upload, error = read_comparison_upload()
+        if error:
+            return error
+        
+        text1 = read_file_content(upload['file1'], upload['hash1'])
+        text2 = read_file_content(upload['file2'], upload['hash2'])
+        
+        result = compare_revision(document, text1, upload['hash1'], text2, upload['hash2'], upload['sequence_mode'],
+                                  upload['response_format'], upload['include_text'])
+        if debug_requested():
+            result['timings'] = debug_timings()
+        return jsonify(result)
+    
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"Error in compare_revisions: {error_details}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+@app.route('/compare/jobs', methods=['POST'])
+def create_compare_job():
+    """Start a comparison in the background and return its job ID"""
+    try:
+        upload, error = read_comparison_upload()
+        if error:
+            return error
+        
+        cached = result_cache.get(upload['cache_key'])
+        record_cache_lookup('result', cached is not None)
+        if cached is not None:
+            job_id = comparison_jobs.add_finished(JOB_STAGES, json.loads(cached))
+        else:
+            # Files are read here; the scoring runs in the background
+            text1 = read_file_content(upload['file1'], upload['hash1'])
+            text2 = read_file_content(upload['file2'], upload['hash2'])
+            job_id = comparison_jobs.submit(JOB_STAGES, run_comparison_job, text1, text2,
+                                            upload['sequence_mode'], upload['cache_key'],
+                                            upload['response_format'], upload['include_text'])
         
         return jsonify({
-            'similarity': round(similarity_score, 2),
-            'similarity_breakdown': similarity_breakdown,
-            'common_phrases': common_phrases,
-            'matching_sections': matching_sections,
-            'original_text1': text1,
-            'original_text2': text2
+            'job_id': job_id,
+            'status_url': f'/compare/jobs/{job_id}'
+        }), 202
+    
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"Error in create_compare_job: {error_details}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+@app.route('/compare/jobs/<job_id>')
+def get_compare_job(job_id):
+    """Progress per stage, and the result once the job is done"""
+    job = comparison_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/corpus/documents', methods=['POST'])
+def add_corpus_documents():
+    """Ingest one or more documents into the searchable archive"""
+    try:
+        files = [f for f in request.files.getlist('files') if f.filename]
+        if not files:
+            return jsonify({'error': 'Please upload at least one file'}), 400
+        
+        collection = request.form.get('collection', '')
+        
+        documents = []
+        for file in files:
+            text = read_file_content(file)
+            doc = DocumentAnalysis(text)
+            shingles = get_document_shingles(doc)
+            doc_id, created = corpus_index.add_document(file.filename, text, shingles)
+            
+            fingerprints = fingerprint_ids(doc.stem_ids)
+            fingerprint_store.add_document(file.filename, hashlib.sha256(text.encode('utf-8')).hexdigest(),
+                                           fingerprints, collection)
+            documents.append({
+                'id': doc_id,
+                'name': file.filename,
+                'created': created,
+                'shingles': len(shingles),
+                'fingerprints': len(fingerprints)
+            })
+        
+        return jsonify({
+            'documents': documents,
+            'corpus_size': corpus_index.count_documents()
         })
     
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
-        print(f"Error in compare: {error_details}")
+        print(f"Error in add_corpus_documents: {error_details}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+@app.route('/search', methods=['POST'])
+def search_corpus():
+    """Find the archived documents most similar to an uploaded file"""
+    try:
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return jsonify({'error': 'Please upload a file'}), 400
+        
+        top_k = request.form.get('top_k', 5, type=int)
+        top_k = max(1, min(top_k, MAX_SEARCH_RESULTS))
+        
+        doc = DocumentAnalysis(read_file_content(request.files['file']))
+        
+        # Cheap index lookup first, full breakdown only for the top-k candidates
+        candidates = corpus_index.search(get_document_shingles(doc), top_k)
+        for candidate in candidates:
+            archived_doc = DocumentAnalysis(corpus_index.get_text(candidate['id']))
+            breakdown = calculate_enhanced_similarity(doc, archived_doc)
+            candidate['containment'] = round(candidate['containment'] * 100, 2)
+            candidate['resemblance'] = round(candidate['resemblance'] * 100, 2)
+            candidate['similarity'] = breakdown['overall']
+            candidate['similarity_breakdown'] = breakdown
+        
+        return jsonify({
+            'results': candidates,
+            'corpus_size': corpus_index.count_documents()
+        })
+    
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"Error in search_corpus: {error_details}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+@app.route('/corpus/overlaps', methods=['POST'])
+def find_corpus_overlaps():
+    """Archived documents sharing at least min_shared winnowed fingerprints with an upload"""
+    try:
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return jsonify({'error': 'Please upload a file'}), 400
+        
+        min_shared = max(1, request.form.get('min_shared', WINNOW_MIN_SHARED, type=int))
+        top_k = max(1, min(request.form.get('top_k', MAX_SEARCH_RESULTS, type=int), MAX_SEARCH_RESULTS))
+        exclude_collection = request.form.get('exclude_collection') or None
+        
+        doc = DocumentAnalysis(read_file_content(request.files['file']))
+        fingerprints = fingerprint_ids(doc.stem_ids)
+        matches = fingerprint_store.search(fingerprints, min_shared, top_k, exclude_collection)
+        for match in matches:
+            match['containment'] = round(match['containment'] * 100, 2)
+            match['archived_containment'] = round(match['archived_containment'] * 100, 2)
+        
+        return jsonify({
+            'results': matches,
+            'fingerprints': len(fingerprints),
+            'archive_size': fingerprint_store.count_documents()
+        })
+    
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"Error in find_corpus_overlaps: {error_details}")
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+@app.route('/matrix', methods=['POST'])
+def similarity_matrix():
+    """Lexical similarity of every pair among N uploaded documents"""
+    try:
+        files = [f for f in request.files.getlist('files') if f.filename]
+        if len(files) < 2:
+            return jsonify({'error': 'Please upload at least two files'}), 400
+        if len(files) > MAX_MATRIX_DOCUMENTS:
+            return jsonify({'error': f'At most {MAX_MATRIX_DOCUMENTS} files can be compared at once'}), 400
+        
+        # NumPy and SciPy are only needed here, so they load on the first /matrix request
+        from similarity_matrix import lexical_similarity_matrix
+        
+        frequencies = [DocumentAnalysis(read_file_content(file)).word_frequencies for file in files]
+        cosine, overlap, lexical = lexical_similarity_matrix(frequencies)
+        
+        return jsonify({
+            'names': [file.filename for file in files],
+            'cosine': cosine.round(4).tolist(),
+            'overlap': overlap.round(4).tolist(),
+            'lexical': lexical.round(2).tolist()
+        })
+    
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"Error in similarity_matrix: {error_details}")
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
 if __name__ == '__main__':
@@ -0,0 +1,205 @@
+"""Cross-check every pair of submissions in a directory
+
+Usage:
+    python batch_compare.py submissions/ --output report.csv
+
+Each document is read and analyzed once. Pairs that share too few stemmed
+shingles are skipped before any scorer runs, and the remaining pairs are
+scored in a process pool. The report is ranked by overall similarity.
+"""
+import argparse
+import csv
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+
+from app import DocumentAnalysis, calculate_enhanced_similarity, resolve_sequence_mode
+from corpus_index import hash_shingles
+from pdf_extraction import extract_pdf_text
+
+SUPPORTED_EXTENSIONS = ('.txt', '.pdf')
+
+# Shingles found in more than this share of documents are boilerplate
+# (assignment prompts, citations) and do not count toward the prefilter
+BOILERPLATE_DOC_SHARE = 0.5
+
+# Analyses kept in memory by each scoring worker. Pairs are scored in order,
+# so consecutive pairs share their first document.
+WORKER_CACHED_DOCUMENTS = 8
+
+# Directory of pickled analyses read by every worker process, set by init_worker
+_store_dir = None
+
+
+def read_document(path):
+    """Read a .txt or .pdf file into text"""
+    if path.lower().endswith('.pdf'):
+        with open(path, 'rb') as f:
+            return extract_pdf_text(f)
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def document_path(store_dir, index):
+    return os.path.join(store_dir, f'{index}.pickle')
+
+
+def analyze_file(index, path, store_dir):
+    """Read and analyze one document into the store, returns its shingle hashes"""
+    doc = DocumentAnalysis(read_document(path))
+    with open(document_path(store_dir, index), 'wb') as f:
+        pickle.dump(doc, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return hash_shingles(doc.stems)
+
+
+def init_worker(store_dir):
+    global _store_dir
+    _store_dir = store_dir
+
+
+@lru_cache(maxsize=WORKER_CACHED_DOCUMENTS)
+def load_document(index):
+    with open(document_path(_store_dir, index), 'rb') as f:
+        return pickle.load(f)
+
+
+def score_pair(pair):
+    i, j, sequence_mode = pair
+    return i, j, calculate_enhanced_similarity(load_document(i), load_document(j), sequence_mode)
+
+
+def candidate_pairs(shingle_sets, min_containment):
+    """Pairs whose shared shingles cover at least min_containment of the smaller document"""
+    postings = {}
+    for doc_index, shingles in enumerate(shingle_sets):
+        for shingle in shingles:
+            postings.setdefault(shingle, []).append(doc_index)
+
+    max_docs = max(2, int(len(shingle_sets) * BOILERPLATE_DOC_SHARE))
+    shared = Counter()
+    for docs in postings.values():
+        if len(docs) < 2 or len(docs) > max_docs:
+            continue
+        for a in range(len(docs)):
+            for b in range(a + 1, len(docs)):
+                shared[(docs[a], docs[b])] += 1
+
+    pairs = {}
+    for (i, j), count in shared.items():
+        smaller = min(len(shingle_sets[i]), len(shingle_sets[j]))
+        containment = count / smaller if smaller else 0.0
+        if containment >= min_containment:
+            pairs[(i, j)] = (count, containment)
+    return pairs
+
+
+def all_pairs(shingle_sets):
+    pairs = {}
+    for i in range(len(shingle_sets)):
+        for j in range(i + 1, len(shingle_sets)):
+            count = len(shingle_sets[i] & shingle_sets[j])
+            smaller = min(len(shingle_sets[i]), len(shingle_sets[j]))
+            pairs[(i, j)] = (count, count / smaller if smaller else 0.0)
+    return pairs
+
+
+def write_report(rows, output):
+    if output.lower().endswith('.json'):
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+        return
+
+    fields = ['rank', 'file1', 'file2', 'overall', 'structural', 'lexical', 'semantic', 'sequence',
+              'shared_shingles', 'containment']
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def score_documents(names, paths, store_dir, sequence_mode, args):
+    """Analyze every document into store_dir, then score the candidate pairs: report rows"""
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        shingle_sets = list(executor.map(analyze_file, range(len(paths)), paths, repeat(store_dir), chunksize=8))
+    print(f"Analyzed {len(paths)} documents in {time.time() - start:.1f}s")
+
+    pairs = all_pairs(shingle_sets) if args.no_prefilter else candidate_pairs(shingle_sets, args.min_containment)
+    total_pairs = len(paths) * (len(paths) - 1) // 2
+    print(f"Scoring {len(pairs)} of {total_pairs} pairs")
+
+    # Workers read each analysis from the store when a pair needs it and keep
+    # only the last few, instead of every worker holding every document
+    start = time.time()
+    rows = []
+    tasks = [(i, j, sequence_mode) for i, j in sorted(pairs)]
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(store_dir,)) as executor:
+        for i, j, breakdown in executor.map(score_pair, tasks, chunksize=16):
+            shared, containment = pairs[(i, j)]
+            rows.append({
+                'file1': names[i],
+                'file2': names[j],
+                'overall': breakdown['overall'],
+                'structural': breakdown['structural'],
+                'lexical': breakdown['lexical'],
+                'semantic': breakdown['semantic'],
+                'sequence': breakdown['sequence'],
+                'shared_shingles': shared,
+                'containment': round(containment * 100, 2)
+            })
+    print(f"Scored {len(rows)} pairs in {time.time() - start:.1f}s")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare every pair of .txt/.pdf submissions in a directory')
+    parser.add_argument('directory', help='folder of submissions')
+    parser.add_argument('--output', default='similarity_report.csv', help='report path (.csv or .json)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--min-containment', type=float, default=0.02,
+                        help='skip pairs sharing fewer shingles than this share of the smaller document')
+    parser.add_argument('--no-prefilter', action='store_true', help='score every pair')
+    parser.add_argument('--sequence-mode', default='fast', help='exact, fast or a sequence backend name')
+    parser.add_argument('--top', type=int, default=0, help='only report the N most similar pairs')
+    parser.add_argument('--work-dir', default=None, help='where to keep the analyzed documents while scoring')
+    args = parser.parse_args(argv)
+
+    try:
+        sequence_mode = resolve_sequence_mode(args.sequence_mode)
+    except ValueError as e:
+        parser.error(str(e))
+
+    names = sorted(name for name in os.listdir(args.directory)
+                   if name.lower().endswith(SUPPORTED_EXTENSIONS))
+    if len(names) < 2:
+        parser.error('need at least two .txt or .pdf files')
+    paths = [os.path.join(args.directory, name) for name in names]
+
+    with tempfile.TemporaryDirectory(prefix='batch-analyses-', dir=args.work_dir) as store_dir:
+        rows = score_documents(names, paths, store_dir, sequence_mode, args)
+
+    rows.sort(key=lambda row: row['overall'], reverse=True)
+    if args.top:
+        rows = rows[:args.top]
+    for rank, row in enumerate(rows, 1):
+        row['rank'] = rank
+
+    write_report(rows, args.output)
+    print(f"Wrote {len(rows)} pairs to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,391 @@
+"""Benchmark the plagiarism scoring pipeline
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 1000 10000 --baseline bench.json
+
+Builds deterministic synthetic document pairs (one with copied passages, one
+paraphrased) at each size, times every scorer on pre-analyzed documents and
+the end-to-end /compare call through the Flask test client, and records the
+peak traced memory of each stage and the error of every sequence backend
+against exact difflib. Worker start-up is timed in fresh
+interpreters against STARTUP_TARGET_SECONDS. Results are written as JSON tagged with the
+git commit so runs from different commits can be compared with --baseline.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DEFAULT_SIZES = [1000, 10000, 100000, 500000]
+CORPORA = ['copied', 'paraphrased']
+
+# Exact difflib is quadratic in characters; larger pairs use the fast backend end to end
+EXACT_MAX_WORDS = 10000
+
+# A worker started from a stem snapshot should analyze its first document this soon after launch
+STARTUP_TARGET_SECONDS = 0.5
+STARTUP_WORDS = 1000
+
+# Sentence matching should stay near linear: at most this many seconds per 1k words
+# of the larger document (about 1.8s at 40k words when it was set; exhaustive
+# candidate enumeration took 23s there)
+MATCHING_TARGET_SECONDS_PER_1K_WORDS = 0.1
+
+# Share of sentences copied into the second document of a 'copied' pair
+COPIED_SHARE = 0.3
+
+# Share of words swapped for a synonym in a 'paraphrased' pair
+SYNONYM_SHARE = 0.25
+
+FUNCTION_WORDS = ['the', 'of', 'and', 'to', 'a', 'in', 'is', 'that', 'for', 'it', 'as', 'was', 'with',
+                  'be', 'by', 'on', 'not', 'this', 'are', 'or', 'from', 'which', 'an', 'but', 'were']
+SYLLABLES = ['ka', 'lo', 'mi', 'ser', 'tan', 'vo', 're', 'dun', 'pli', 'gar', 'nos', 'ti', 'bel', 'cor',
+             'fa', 'quin', 'tro', 'mel', 'sa', 'ven', 'dra', 'lu', 'pon', 'ex', 'ri', 'ston', 'ga', 'mor']
+
+
+def make_vocabulary(rng, size=20000):
+    """Pseudo-words with Zipf weights, the most frequent being English function words"""
+    words = list(FUNCTION_WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+
+    cumulative = []
+    total = 0.0
+    for rank in range(1, len(words) + 1):
+        total += 1.0 / rank
+        cumulative.append(total)
+    return words, cumulative
+
+
+def make_sentences(rng, vocabulary, word_count):
+    """Sentences of 8-25 words totalling word_count words"""
+    words, cumulative = vocabulary
+    tokens = rng.choices(words, cum_weights=cumulative, k=word_count)
+    sentences = []
+    start = 0
+    while start < word_count:
+        end = min(word_count, start + rng.randint(8, 25))
+        sentences.append(tokens[start:end])
+        start = end
+    return sentences
+
+
+def render(rng, sentences):
+    """Join sentences into text, 3-8 sentences per paragraph"""
+    paragraphs = []
+    start = 0
+    while start < len(sentences):
+        end = start + rng.randint(3, 8)
+        paragraphs.append(' '.join(
+            ' '.join(sentence).capitalize() + rng.choice('...?!')
+            for sentence in sentences[start:end]))
+        start = end
+    return '\n\n'.join(paragraphs)
+
+
+def paraphrase(rng, sentence, synonyms):
+    """Swap words for synonyms and occasionally drop, insert or reorder words"""
+    words = [synonyms.get(word, word) if rng.random() < SYNONYM_SHARE else word for word in sentence]
+    if len(words) > 6 and rng.random() < 0.3:
+        del words[rng.randrange(len(words))]
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(FUNCTION_WORDS))
+    if len(words) > 8 and rng.random() < 0.2:
+        cut = rng.randrange(2, len(words) - 2)
+        words = words[cut:] + words[:cut]
+    return words
+
+
+def make_pair(corpus, word_count, seed=0):
+    """Deterministic (text1, text2) pair of about word_count words each"""
+    rng = random.Random(f'{corpus}-{word_count}-{seed}')
+    vocabulary = make_vocabulary(rng)
+    sentences1 = make_sentences(rng, vocabulary, word_count)
+
+    if corpus == 'copied':
+        # Independent text with a share of verbatim sentences from text 1
+        sentences2 = make_sentences(rng, vocabulary, word_count)
+        for k in range(len(sentences2)):
+            if rng.random() < COPIED_SHARE:
+                sentences2[k] = sentences1[rng.randrange(len(sentences1))]
+    elif corpus == 'paraphrased':
+        words = vocabulary[0]
+        synonyms = {word: rng.choice(words) for word in words[len(FUNCTION_WORDS):]}
+        sentences2 = [paraphrase(rng, sentence, synonyms) for sentence in sentences1]
+    else:
+        raise ValueError(f"Unknown corpus: {corpus}")
+
+    return render(rng, sentences1), render(rng, sentences2)
+
+
+def git_commit():
+    """Current commit and whether the tree has uncommitted changes, or (None, None)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=here, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--', '.'], cwd=here, capture_output=True,
+                                text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def measure(func, repeat, time_budget, memory):
+    """Time func up to repeat times (at least once, stopping after time_budget seconds)
+    and trace its peak memory in one extra run"""
+    timings = []
+    while len(timings) < repeat:
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        if sum(timings) > time_budget:
+            break
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'runs': len(timings),
+        'min_seconds': round(min(timings), 6),
+        'median_seconds': round(statistics.median(timings), 6),
+        'peak_memory_bytes': peak
+    }
+
+
+def scratch_environ(scratch):
+    # Keep benchmark uploads and pseudo-words out of the real databases and stem snapshot
+    return {
+        'CORPUS_DB': os.path.join(scratch, 'corpus.db'),
+        'RESULT_CACHE_DB': os.path.join(scratch, 'results.db'),
+        'REVISIONS_DB': os.path.join(scratch, 'revisions.db'),
+        'FINGERPRINT_DB': os.path.join(scratch, 'fingerprints.db'),
+        'STEM_CACHE_PATH': os.path.join(scratch, 'stems.json.gz')
+    }
+
+
+def load_app(scratch):
+    os.environ.update(scratch_environ(scratch))
+    import app
+    return app
+
+
+def measure_startup(scratch, repeat):
+    """Wall time from launching a fresh interpreter to having analyzed one document,
+    without a stem snapshot ('cold') and with the snapshot the cold runs left ('warm')"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    document = os.path.join(scratch, 'startup.txt')
+    with open(document, 'w', encoding='utf-8') as f:
+        f.write(make_pair('copied', STARTUP_WORDS)[0])
+    script = ('import sys, app; '
+              'app.DocumentAnalysis(open(sys.argv[1], encoding="utf-8").read())')
+
+    results = {}
+    for stage in ['cold', 'warm']:
+        startup_scratch = os.path.join(scratch, 'startup')
+        os.makedirs(startup_scratch, exist_ok=True)
+        env = dict(os.environ, **scratch_environ(startup_scratch))
+        timings = []
+        for _ in range(repeat):
+            if stage == 'cold' and os.path.exists(env['STEM_CACHE_PATH']):
+                os.unlink(env['STEM_CACHE_PATH'])
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', script, document], cwd=here, env=env, check=True)
+            timings.append(time.perf_counter() - start)
+        median = statistics.median(timings)
+        results[stage] = {
+            'runs': len(timings),
+            'min_seconds': round(min(timings), 6),
+            'median_seconds': round(median, 6),
+            'peak_memory_bytes': None
+        }
+        verdict = ''
+        if stage == 'warm':
+            results[stage]['target_seconds'] = STARTUP_TARGET_SECONDS
+            results[stage]['within_target'] = median <= STARTUP_TARGET_SECONDS
+            verdict = 'within target' if median <= STARTUP_TARGET_SECONDS else f'over the {STARTUP_TARGET_SECONDS}s target'
+        print(f"  {stage:<20} {median:>10.4f}s  {verdict}", flush=True)
+    return results
+
+
+def post_compare(client, text1, text2, **form):
+    form['file1'] = (io.BytesIO(text1.encode('utf-8')), 'file1.txt')
+    form['file2'] = (io.BytesIO(text2.encode('utf-8')), 'file2.txt')
+    response = client.post('/compare', data=form, content_type='multipart/form-data')
+    if response.status_code != 200:
+        raise RuntimeError(f"/compare returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def benchmark_pair(app, scratch, text1, text2, args):
+    """Every stage for one document pair, as {stage: measurement}"""
+    doc1 = app.DocumentAnalysis(text1)
+    doc2 = app.DocumentAnalysis(text2)
+    exact_allowed = len(doc1.words) <= args.exact_max_words
+
+    stages = {
+        'analyze': lambda: (app.DocumentAnalysis(text1), app.DocumentAnalysis(text2)),
+        'structural': lambda: app.calculate_structural_similarity(app.analyze_structure(doc1),
+                                                                  app.analyze_structure(doc2)),
+        'lexical': lambda: app.calculate_lexical_similarity(doc1, doc2),
+        'semantic': lambda: app.calculate_semantic_similarity(doc1, doc2),
+    }
+    for backend in app.SEQUENCE_BACKENDS:
+        if backend in ('exact', 'quick') and not exact_allowed:
+            continue
+        stages[f'sequence:{backend}'] = lambda backend=backend: app.calculate_sequence_ratio(doc1, doc2, backend)
+    stages.update({
+        'common_phrases': lambda: app.find_common_phrases(doc1, doc2),
+        'matching_sections': lambda: app.find_matching_sections(doc1, doc2),
+        'highlighting': lambda: app.highlight_matching_text(doc1, doc2),
+        'compact_highlights': lambda: app.compact_highlights(doc1, doc2),
+    })
+
+    if not args.skip_compare:
+        client = app.app.test_client()
+        sequence_mode = 'exact' if exact_allowed else 'fast'
+        cache_dir = tempfile.mkdtemp(dir=scratch)
+        cache_count = [0]
+
+        def fresh_compare(response_format):
+            # A new cache per run so every call takes the miss path
+            cache_count[0] += 1
+            app.result_cache = app.ResultCache(os.path.join(cache_dir, f'{cache_count[0]}.db'))
+            post_compare(client, text1, text2, sequence_mode=sequence_mode, format=response_format)
+
+        def cached_compare():
+            post_compare(client, text1, text2, sequence_mode=sequence_mode, format='compact')
+
+        stages['compare'] = lambda: fresh_compare('full')
+        stages['compare_compact'] = lambda: fresh_compare('compact')
+        stages['compare_cached'] = cached_compare
+
+    results = {}
+    for stage, func in stages.items():
+        if args.stages and stage.split(':')[0] not in args.stages:
+            continue
+        results[stage] = measure(func, args.repeat, args.time_budget, not args.no_memory)
+        verdict = ''
+        if stage == 'matching_sections':
+            target = MATCHING_TARGET_SECONDS_PER_1K_WORDS * max(len(doc1.words), len(doc2.words)) / 1000
+            within = results[stage]['median_seconds'] <= target
+            results[stage]['target_seconds'] = round(target, 6)
+            results[stage]['within_target'] = within
+            verdict = 'within target' if within else f'over the {target:.2f}s target'
+        print(f"  {stage:<20} {results[stage]['median_seconds']:>10.4f}s  {verdict}", flush=True)
+
+    # Error of each timed sequence backend against exact difflib, where exact is affordable
+    if exact_allowed and any(stage.startswith('sequence:') for stage in results):
+        for backend, accuracy in app.compare_sequence_backends(doc1, doc2).items():
+            stage = f'sequence:{backend}'
+            if stage in results:
+                results[stage]['error'] = round(accuracy['error'], 6)
+                results[stage]['error_bound'] = accuracy['error_bound']
+                print(f"  {stage:<20} error {accuracy['error']:.4f}", flush=True)
+    return results, {'words': [len(doc1.words), len(doc2.words)], 'chars': [len(text1), len(text2)],
+                     'sequence_mode': 'exact' if exact_allowed else 'fast'}
+
+
+def compare_with_baseline(results, baseline_path):
+    """Print the median time of each stage relative to an earlier run"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(row['corpus'], row['size'], row['stage']): row for row in baseline['results']}
+
+    print(f"\nAgainst {baseline_path} (commit {baseline.get('commit')}):")
+    for row in results:
+        old = previous.get((row['corpus'], row['size'], row['stage']))
+        if old is None or not old['median_seconds']:
+            continue
+        ratio = row['median_seconds'] / old['median_seconds']
+        print(f"  {row['corpus']:<12} {row['size']:>7} {row['stage']:<20} "
+              f"{old['median_seconds']:>9.4f}s -> {row['median_seconds']:>9.4f}s  x{ratio:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the similarity scorers and /compare')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='words per document')
+    parser.add_argument('--corpus', choices=CORPORA, nargs='+', default=CORPORA, help='document pair kinds')
+    parser.add_argument('--stages', nargs='+', help='only run these stages (e.g. semantic sequence compare)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage')
+    parser.add_argument('--time-budget', type=float, default=30.0,
+                        help='stop repeating a stage once its runs took this many seconds')
+    parser.add_argument('--exact-max-words', type=int, default=EXACT_MAX_WORDS,
+                        help='skip exact difflib above this many words')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced peak memory run')
+    parser.add_argument('--skip-compare', action='store_true', help='skip the end-to-end /compare calls')
+    parser.add_argument('--skip-startup', action='store_true', help='skip the worker start-up measurement')
+    parser.add_argument('--output', help='results path (default benchmark-<commit>.json)')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    commit, dirty = git_commit()
+    scratch = tempfile.mkdtemp(prefix='benchmark-')
+    app = load_app(scratch)
+
+    results = []
+    pairs = {}
+    if not args.skip_startup:
+        print(f"Worker start-up, {STARTUP_WORDS} word document", flush=True)
+        for stage, measurement in measure_startup(scratch, args.repeat).items():
+            results.append(dict(corpus='startup', size=STARTUP_WORDS, stage=stage, **measurement))
+
+    for corpus in args.corpus:
+        for size in args.sizes:
+            print(f"{corpus} pair, {size} words", flush=True)
+            text1, text2 = make_pair(corpus, size)
+            stages, pair_info = benchmark_pair(app, scratch, text1, text2, args)
+            pairs[f'{corpus}-{size}'] = pair_info
+            for stage, measurement in stages.items():
+                results.append(dict(corpus=corpus, size=size, stage=stage, **measurement))
+
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {
+            'repeat': args.repeat,
+            'time_budget': args.time_budget,
+            'exact_max_words': args.exact_max_words,
+            'stages': args.stages,
+            'memory': not args.no_memory,
+            'startup_target_seconds': STARTUP_TARGET_SECONDS
+        },
+        'pairs': pairs,
+        'results': results
+    }
+
+    output = args.output or f"benchmark-{(commit or 'unknown')[:12]}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} measurements to {output}")
+
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
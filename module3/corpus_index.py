@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+import hashlib
+
+# Number of stemmed words per shingle
+SHINGLE_SIZE = 5
+
+
+def hash_shingles(stems, size=SHINGLE_SIZE):
+    """Hash every run of `size` stems into a stable 64-bit integer"""
+    hashes = set()
+    for i in range(len(stems) - size + 1):
+        shingle = ' '.join(stems[i:i+size]).encode('utf-8')
+        digest = hashlib.blake2b(shingle, digest_size=8).digest()
+        # SQLite integers are signed 64-bit
+        hashes.add(int.from_bytes(digest, 'big', signed=True))
+    return hashes
+
+
+class CorpusIndex:
+    """Persistent inverted index from stemmed shingles to archived documents"""
+
+    def __init__(self, db_name="corpus.db"):
+        self.db_name = db_name
+        # Tables are created by the first connection, so constructing the index touches no files
+        self.initialized = False
+        self.init_lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_name)
+        conn.execute('PRAGMA journal_mode=WAL')
+        if not self.initialized:
+            self.init_database(conn)
+        return conn
+
+    def init_database(self, conn):
+        # Create document and posting tables if they don't exist
+        with self.init_lock:
+            if self.initialized:
+                return
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    content_hash TEXT UNIQUE NOT NULL,
+                    text TEXT NOT NULL,
+                    shingle_count INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    shingle INTEGER NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    PRIMARY KEY (shingle, doc_id)
+                ) WITHOUT ROWID;
+            ''')
+            conn.commit()
+            self.initialized = True
+
+    def add_document(self, name, text, shingles):
+        """Store a document and its shingle postings, returns (doc_id, created)"""
+        content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT id FROM documents WHERE content_hash = ?',
+                               (content_hash,)).fetchone()
+            if row:
+                return row[0], False
+
+            cursor = conn.execute('''
+                INSERT INTO documents (name, content_hash, text, shingle_count)
+                VALUES (?, ?, ?, ?)
+            ''', (name, content_hash, text, len(shingles)))
+            doc_id = cursor.lastrowid
+            conn.executemany('INSERT OR IGNORE INTO postings (shingle, doc_id) VALUES (?, ?)',
+                             ((shingle, doc_id) for shingle in shingles))
+            conn.commit()
+            return doc_id, True
+        finally:
+            conn.close()
+
+    def search(self, shingles, top_k=10):
+        """Rank archived documents by how many query shingles they share"""
+        if not shingles:
+            return []
+
+        conn = self.connect()
+        try:
+            # Join against a temp table so large queries stay a single indexed lookup
+            conn.execute('CREATE TEMP TABLE query (shingle INTEGER PRIMARY KEY)')
+            conn.executemany('INSERT OR IGNORE INTO query (shingle) VALUES (?)',
+                             ((shingle,) for shingle in shingles))
+            rows = conn.execute('''
+                SELECT d.id, d.name, d.shingle_count, COUNT(*) AS shared
+                FROM query q
+                JOIN postings p ON p.shingle = q.shingle
+                JOIN documents d ON d.id = p.doc_id
+                GROUP BY d.id
+                ORDER BY shared DESC
+                LIMIT ?
+            ''', (top_k,)).fetchall()
+        finally:
+            conn.close()
+
+        query_count = len(shingles)
+        results = []
+        for doc_id, name, doc_count, shared in rows:
+            union = query_count + doc_count - shared
+            results.append({
+                'id': doc_id,
+                'name': name,
+                'shared_shingles': shared,
+                'containment': shared / query_count,
+                'resemblance': shared / union if union else 0.0
+            })
+        return results
+
+    def get_text(self, doc_id):
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT text FROM documents WHERE id = ?', (doc_id,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def count_documents(self):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+        finally:
+            conn.close()
@@ -0,0 +1,132 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting"""
+
+
+class JobManager:
+    """Runs long comparisons in the background and tracks progress per stage
+
+    Each job is driven by one of `max_running` coordinator threads, which hand
+    the CPU-heavy stages to a shared process pool. At most `max_pending` jobs
+    wait in the queue; beyond that, submit() raises JobQueueFull so web workers
+    never block on a backlog. mp_context is the multiprocessing context of the
+    pool; inside a threaded server it should not fork.
+    """
+
+    def __init__(self, max_running=2, max_pending=16, processes=None, retention_seconds=3600, mp_context=None):
+        self.max_running = max_running
+        self.processes = processes or min(os.cpu_count() or 1, max_running)
+        self.mp_context = mp_context
+        self.retention_seconds = retention_seconds
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = None
+        self.threads = []
+
+    def start(self):
+        # Worker processes and threads are only created once a job arrives
+        with self.lock:
+            if self.executor is not None:
+                return
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=self.mp_context)
+            for _ in range(self.max_running):
+                thread = threading.Thread(target=self.work, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def new_job(self, stages):
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': 'queued',
+            'stages': {stage: 'pending' for stage in stages},
+            'progress': 0.0,
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'finished_at': None
+        }
+        with self.lock:
+            self.prune()
+            self.jobs[job['id']] = job
+        return job
+
+    def submit(self, stages, pipeline, *args):
+        """Queue pipeline(executor, report, *args) and return the new job ID"""
+        self.start()
+        job = self.new_job(stages)
+        try:
+            self.pending.put_nowait((job['id'], pipeline, args))
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job['id']]
+            raise JobQueueFull('Too many comparisons are queued, try again later')
+        return job['id']
+
+    def add_finished(self, stages, result):
+        """Record a job whose result is already known (e.g. from a cache)"""
+        job = self.new_job(stages)
+        with self.lock:
+            job['stages'] = {stage: 'done' for stage in stages}
+            job['progress'] = 1.0
+            job['status'] = 'done'
+            job['result'] = result
+            job['finished_at'] = time.time()
+        return job['id']
+
+    def get(self, job_id):
+        """Snapshot of a job's state, or None if unknown or expired"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            snapshot['stages'] = dict(job['stages'])
+            snapshot['queue_position'] = self.queue_position(job_id) if job['status'] == 'queued' else None
+            return snapshot
+
+    def queue_position(self, job_id):
+        waiting = [item[0] for item in list(self.pending.queue)]
+        return waiting.index(job_id) + 1 if job_id in waiting else None
+
+    def prune(self):
+        # Forget finished jobs once nobody is likely to poll them
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job['finished_at'] is not None and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def work(self):
+        while True:
+            job_id, pipeline, args = self.pending.get()
+            job = self.jobs[job_id]
+
+            def report(stage, state):
+                with self.lock:
+                    job['stages'][stage] = state
+                    done = sum(1 for s in job['stages'].values() if s == 'done')
+                    job['progress'] = round(done / len(job['stages']), 2)
+
+            with self.lock:
+                job['status'] = 'running'
+            try:
+                result = pipeline(self.executor, report, *args)
+                with self.lock:
+                    job['result'] = result
+                    job['status'] = 'done'
+            except Exception as e:
+                with self.lock:
+                    job['error'] = str(e)
+                    job['status'] = 'failed'
+            finally:
+                with self.lock:
+                    job['finished_at'] = time.time()
+                self.pending.task_done()
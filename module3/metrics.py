@@ -0,0 +1,93 @@
+import bisect
+import threading
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+# Upper bounds of the document size buckets, in words
+WORD_BUCKETS = [100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000]
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class HistogramMetric:
+    """Cumulative bucket counts, sum and count per label set"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], series):
+                cumulative += count
+                le = format_labels(labels + (('le', bound if bound == '+Inf' else format_value(bound)),))
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(series[-1])}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+class CounterMetric:
+    """Monotonic count per label set"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def observe(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, count in sorted(self.series.items()):
+            lines.append(f'{self.name}{format_labels(labels)} {format_value(count)}')
+        return lines
+
+
+class MetricsRegistry:
+    """Thread-safe metrics for this process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            return self.metrics.setdefault(name, HistogramMetric(name, help_text, buckets))
+
+    def counter(self, name, help_text):
+        with self.lock:
+            return self.metrics.setdefault(name, CounterMetric(name, help_text))
+
+    def observe(self, metric, value=1, **labels):
+        with self.lock:
+            metric.observe(tuple(sorted(labels.items())), value)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for name in sorted(self.metrics):
+                lines.extend(self.metrics[name].render())
+        return '\n'.join(lines) + '\n'
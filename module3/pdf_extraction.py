@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from process_pools import server_process_context
+
+# Uploads larger than this are spooled to a temp file instead of RAM
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Below this many pages the process pool costs more than it saves
+PARALLEL_MIN_PAGES = 24
+PAGES_PER_TASK = 8
+MAX_WORKERS = min(os.cpu_count() or 1, 8)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process pool shared by all PDF extractions, created on first use"""
+    global _executor
+    # Concurrent uploads must not each start a pool
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=server_process_context())
+        return _executor
+
+
+def extract_page_range(path, start, end):
+    """Extract the text of pages [start, end) - runs in a worker process"""
+    import PyPDF2
+    reader = PyPDF2.PdfReader(path)
+    return [reader.pages[i].extract_text() for i in range(start, end)]
+
+
+def extract_pages_parallel(spool, page_count):
+    # Workers need a real path to open, so copy the spool to a named file
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as named:
+        shutil.copyfileobj(spool, named)
+    try:
+        executor = get_executor()
+        futures = [executor.submit(extract_page_range, named.name, start, min(start + PAGES_PER_TASK, page_count))
+                   for start in range(0, page_count, PAGES_PER_TASK)]
+        pages = []
+        for future in futures:
+            pages.extend(future.result())
+        return pages
+    finally:
+        os.unlink(named.name)
+
+
+def extract_pdf_text(stream):
+    """Extract the text of a PDF stream, one line break after each page"""
+    # Imported on first use to keep server start-up fast
+    import PyPDF2
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+        shutil.copyfileobj(stream, spool)
+        spool.seek(0)
+        reader = PyPDF2.PdfReader(spool)
+        page_count = len(reader.pages)
+
+        if page_count < PARALLEL_MIN_PAGES or MAX_WORKERS < 2:
+            pages = [page.extract_text() for page in reader.pages]
+        else:
+            spool.seek(0)
+            pages = extract_pages_parallel(spool, page_count)
+
+    return ''.join(page + '\n' for page in pages)
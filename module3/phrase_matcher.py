@@ -0,0 +1,154 @@
+import hashlib
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+
+# A shared run of tokens: file1[file1_start:file1_start+length] == file2[file2_start:file2_start+length]
+Tile = namedtuple('Tile', ['file1_start', 'file2_start', 'length'])
+
+# Karp-Rabin rolling hash parameters
+HASH_BASE = 1000003
+HASH_MOD = (1 << 61) - 1
+
+
+@lru_cache(maxsize=1 << 16)
+def token_id(token):
+    """Stable 60-bit ID of a token, the same in every process and every run"""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big') >> 4
+
+
+def token_ids(tokens):
+    """Compact array of the IDs of a token sequence, each distinct token hashed once"""
+    ids = {token: token_id(token) for token in set(tokens)}
+    return array('q', [ids[token] for token in tokens])
+
+
+def rolling_hashes(ids, n):
+    """Hash of every window of n IDs, computed in one pass"""
+    if n <= 0 or len(ids) < n:
+        return []
+
+    high = pow(HASH_BASE, n - 1, HASH_MOD)
+    h = 0
+    for x in ids[:n]:
+        h = (h * HASH_BASE + x + 1) % HASH_MOD
+    hashes = [h]
+    for i in range(n, len(ids)):
+        h = ((h - (ids[i - n] + 1) * high) * HASH_BASE + ids[i] + 1) % HASH_MOD
+        hashes.append(h)
+    return hashes
+
+
+def window_hash(ids, i, n):
+    """Hash of the window ids[i:i+n], equal to the one rolling_hashes gives it"""
+    h = 0
+    for x in ids[i:i+n]:
+        h = (h * HASH_BASE + x + 1) % HASH_MOD
+    return h
+
+
+def index_windows(ids, n):
+    """Window hash -> start positions of every window of n IDs"""
+    window_index = {}
+    for j, h in enumerate(rolling_hashes(ids, n)):
+        window_index.setdefault(h, []).append(j)
+    return window_index
+
+
+def find_shared_runs(ids1, ids2, min_length, max_occurrences=None, work_budget=None):
+    """Find every maximal run of at least min_length token IDs found in both sequences
+
+    max_occurrences limits how many sequence 2 positions are tried for one window,
+    so boilerplate repeated hundreds of times cannot dominate. work_budget caps the
+    number of token comparisons spent on the exhaustive search; once it is used up
+    the rest of sequence 1 is still scanned, but greedily (first occurrence only,
+    skipping tokens already inside a run), which is linear in the input size.
+    """
+    n1, n2 = len(ids1), len(ids2)
+    window_index = index_windows(ids2, min_length)
+
+    tiles = []
+    # Diagonal (i - j) -> end in sequence 1 of the last run found on it
+    run_ends = {}
+    work = 0
+    greedy = False
+    greedy_end = 0
+
+    for i, h in enumerate(rolling_hashes(ids1, min_length)):
+        positions = window_index.get(h)
+        if not positions:
+            continue
+
+        if greedy:
+            if i < greedy_end:
+                continue
+            positions = positions[:1]
+        elif max_occurrences is not None:
+            positions = positions[:max_occurrences]
+
+        for j in positions:
+            diagonal = i - j
+            # Already inside a run reported on this diagonal
+            if run_ends.get(diagonal, -1) > i:
+                continue
+            # Guard against hash collisions
+            work += min_length
+            if ids1[i:i+min_length] != ids2[j:j+min_length]:
+                continue
+
+            end = i + min_length
+            while end < n1 and end - diagonal < n2 and ids1[end] == ids2[end - diagonal]:
+                end += 1
+            work += end - i
+            run_ends[diagonal] = end
+            greedy_end = max(greedy_end, end)
+            tiles.append(Tile(i, j, end - i))
+
+        if work_budget is not None and work > work_budget:
+            greedy = True
+
+    return tiles
+
+
+def find_runs_through(ids1, ids2, positions, min_length, max_occurrences=None):
+    """Find every maximal shared run of at least min_length token IDs that
+    includes one of the given sequence 1 positions
+
+    These are the runs find_shared_runs reports that touch positions (without a
+    work budget), found from the windows around positions alone. A run is
+    extended both ways from the first such window, so it is reported whole even
+    when it starts or ends far from every position.
+    """
+    n1, n2 = len(ids1), len(ids2)
+    window_index = index_windows(ids2, min_length)
+
+    # Start of every window holding at least one of the positions
+    starts = sorted({i for p in positions
+                     for i in range(max(p - min_length + 1, 0), min(p, n1 - min_length) + 1)})
+
+    tiles = []
+    run_ends = {}
+    for i in starts:
+        candidates = window_index.get(window_hash(ids1, i, min_length))
+        if not candidates:
+            continue
+        if max_occurrences is not None:
+            candidates = candidates[:max_occurrences]
+
+        for j in candidates:
+            diagonal = i - j
+            if run_ends.get(diagonal, -1) > i:
+                continue
+            if ids1[i:i+min_length] != ids2[j:j+min_length]:
+                continue
+
+            start = i
+            while start > 0 and start - diagonal > 0 and ids1[start - 1] == ids2[start - 1 - diagonal]:
+                start -= 1
+            end = i + min_length
+            while end < n1 and end - diagonal < n2 and ids1[end] == ids2[end - diagonal]:
+                end += 1
+            run_ends[diagonal] = end
+            tiles.append(Tile(start, start - diagonal, end - start))
+
+    return tiles
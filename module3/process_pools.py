@@ -0,0 +1,12 @@
+import multiprocessing
+
+
+def server_process_context():
+    """Multiprocessing context for process pools created inside the threaded server
+
+    A forked child inherits every lock another thread happened to hold at that
+    moment (stem cache, metrics, SQLite) and can deadlock on it, so workers
+    start from a forkserver instead, or are spawned where that is unavailable.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
@@ -0,0 +1,108 @@
+import sqlite3
+import hashlib
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+def make_cache_key(**parts):
+    """SHA-256 over the JSON of everything that determines a result"""
+    payload = json.dumps(parts, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+class ResultCache:
+    """In-memory LRU in front of a size-bounded SQLite table of JSON results"""
+
+    def __init__(self, db_name="results.db", memory_items=64, max_disk_bytes=256 * 1024 * 1024):
+        self.db_name = db_name
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        # The table is created on first use rather than here
+        self.initialized = False
+        self.init_lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_name)
+        conn.execute('PRAGMA journal_mode=WAL')
+        if not self.initialized:
+            self.init_database(conn)
+        return conn
+
+    def init_database(self, conn):
+        with self.init_lock:
+            if self.initialized:
+                return
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access);
+            ''')
+            conn.commit()
+            self.initialized = True
+
+    def remember(self, key, value):
+        with self.lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached JSON text for key, or None"""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE results SET last_access = ? WHERE key = ?', (time.time(), key))
+            conn.commit()
+        finally:
+            conn.close()
+
+        value = zlib.decompress(row[0]).decode('utf-8')
+        self.remember(key, value)
+        return value
+
+    def put(self, key, value):
+        """Store JSON text under key in both tiers"""
+        self.remember(key, value)
+
+        blob = zlib.compress(value.encode('utf-8'))
+        conn = self.connect()
+        try:
+            conn.execute('''
+                INSERT OR REPLACE INTO results (key, value, size, last_access)
+                VALUES (?, ?, ?, ?)
+            ''', (key, blob, len(blob), time.time()))
+            self.evict(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def evict(self, conn):
+        # Drop least recently used rows until the table fits the size limit
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        stale = []
+        for key, size in conn.execute('SELECT key, size FROM results ORDER BY last_access'):
+            if total <= self.max_disk_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        conn.executemany('DELETE FROM results WHERE key = ?', stale)
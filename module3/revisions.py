@@ -0,0 +1,179 @@
+import sqlite3
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+
+# A blank line between two sentences starts a new paragraph
+PARAGRAPH_BREAK = re.compile(r'\n[^\S\n]*\n')
+
+# Bump when the per-paragraph results kept in the store change shape
+PARAGRAPH_RESULTS_VERSION = 3
+
+
+def paragraph_groups(text, spans):
+    """Group sentence spans into paragraphs: [(first_span, end_span, fingerprint)]
+
+    Paragraphs are made of whole sentences, so an unchanged paragraph always
+    splits into the same sentences whatever the rest of the text looks like.
+    """
+    groups = []
+    first = 0
+    for k in range(1, len(spans) + 1):
+        if k < len(spans) and not PARAGRAPH_BREAK.search(text, spans[k - 1][1], spans[k][0]):
+            continue
+        content = text[spans[first][0]:spans[k - 1][1]]
+        fingerprint = hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+        groups.append((first, k, fingerprint))
+        first = k
+    return groups
+
+
+class RevisionStore:
+    """Paragraph fingerprints of every version of a document, and the per-paragraph
+    results they produced, so a revision only re-scores what changed
+
+    Paragraph results are a cache: like ResultCache, the least recently used
+    ones are dropped once they take more than max_disk_bytes.
+    """
+
+    def __init__(self, db_name="revisions.db", max_disk_bytes=256 * 1024 * 1024):
+        self.db_name = db_name
+        self.max_disk_bytes = max_disk_bytes
+        # Schema set up by the first connect()
+        self.initialized = False
+        self.init_lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_name)
+        conn.execute('PRAGMA journal_mode=WAL')
+        if not self.initialized:
+            self.init_database(conn)
+        return conn
+
+    def init_database(self, conn):
+        with self.init_lock:
+            if self.initialized:
+                return
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS versions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    document TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    fingerprints TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    UNIQUE (document, version)
+                );
+                -- Unbounded predecessor of paragraph_results, in an older format
+                DROP TABLE IF EXISTS paragraphs;
+                CREATE TABLE IF NOT EXISTS paragraph_results (
+                    fingerprint TEXT NOT NULL,
+                    against TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (fingerprint, against)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_paragraph_results_last_access ON paragraph_results (last_access);
+            ''')
+            conn.commit()
+            self.initialized = True
+
+    def latest_version(self, document):
+        """(version number, paragraph fingerprints) of the newest version, or (0, [])"""
+        conn = self.connect()
+        try:
+            row = conn.execute('''
+                SELECT version, fingerprints FROM versions
+                WHERE document = ? ORDER BY version DESC LIMIT 1
+            ''', (document,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return 0, []
+        return row[0], json.loads(row[1])
+
+    def add_version(self, document, content_hash, fingerprints):
+        """Record a new version unless it matches the newest one, returns its number"""
+        conn = self.connect()
+        try:
+            # Hold the write lock from reading the newest version until the insert,
+            # so concurrent resubmits of one document get consecutive numbers
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('''
+                SELECT version, content_hash FROM versions
+                WHERE document = ? ORDER BY version DESC LIMIT 1
+            ''', (document,)).fetchone()
+            if row is not None and row[1] == content_hash:
+                return row[0]
+
+            version = row[0] + 1 if row else 1
+            conn.execute('''
+                INSERT INTO versions (document, version, content_hash, fingerprints, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (document, version, content_hash, json.dumps(fingerprints), time.time()))
+            conn.commit()
+            return version
+        finally:
+            conn.close()
+
+    def get_paragraphs(self, fingerprints, against):
+        """Stored results of these paragraphs scored against `against`, by fingerprint"""
+        fingerprints = list(set(fingerprints))
+        results = {}
+        conn = self.connect()
+        try:
+            # Stay under SQLite's bound parameter limit
+            for k in range(0, len(fingerprints), 500):
+                batch = fingerprints[k:k+500]
+                placeholders = ','.join('?' * len(batch))
+                for fingerprint, value in conn.execute(f'''
+                    SELECT fingerprint, value FROM paragraph_results
+                    WHERE against = ? AND fingerprint IN ({placeholders})
+                ''', [against] + batch):
+                    results[fingerprint] = json.loads(zlib.decompress(value).decode('utf-8'))
+            if results:
+                now = time.time()
+                conn.executemany('UPDATE paragraph_results SET last_access = ? WHERE fingerprint = ? AND against = ?',
+                                 [(now, fingerprint, against) for fingerprint in results])
+                conn.commit()
+        finally:
+            conn.close()
+        return results
+
+    def put_paragraphs(self, paragraphs, against):
+        """Store {fingerprint: result} for paragraphs scored against `against`"""
+        now = time.time()
+        rows = []
+        for fingerprint, value in paragraphs.items():
+            blob = zlib.compress(json.dumps(value).encode('utf-8'))
+            rows.append((fingerprint, against, blob, len(blob), now))
+
+        conn = self.connect()
+        try:
+            conn.executemany('''
+                INSERT OR REPLACE INTO paragraph_results (fingerprint, against, value, size, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            self.evict(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def evict(self, conn):
+        # Drop least recently used paragraph results until the table fits the size limit
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM paragraph_results').fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        stale = []
+        for fingerprint, against, size in conn.execute(
+                'SELECT fingerprint, against, size FROM paragraph_results ORDER BY last_access'):
+            if total <= self.max_disk_bytes:
+                break
+            stale.append((fingerprint, against))
+            total -= size
+        conn.executemany('DELETE FROM paragraph_results WHERE fingerprint = ? AND against = ?', stale)
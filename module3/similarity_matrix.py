@@ -0,0 +1,41 @@
+import numpy as np
+from scipy import sparse
+
+
+def term_frequency_matrix(frequencies):
+    """Sparse documents x vocabulary matrix from per-document stem counts"""
+    vocabulary = {}
+    rows, cols, counts = [], [], []
+    for row, frequency in enumerate(frequencies):
+        for stem, count in frequency.items():
+            rows.append(row)
+            cols.append(vocabulary.setdefault(stem, len(vocabulary)))
+            counts.append(count)
+    return sparse.csr_matrix((counts, (rows, cols)), shape=(len(frequencies), len(vocabulary)),
+                             dtype=np.float64)
+
+
+def lexical_similarity_matrix(frequencies):
+    """Cosine, vocabulary overlap and lexical score (0-100) for every pair of documents
+
+    Matches calculate_lexical_similarity pair by pair, but computes all N x N
+    values from two sparse matrix products.
+    """
+    tf = term_frequency_matrix(frequencies)
+
+    # Cosine similarity of the term-frequency vectors
+    dots = (tf @ tf.T).toarray()
+    norms = np.sqrt(dots.diagonal())
+    denominators = np.outer(norms, norms)
+    cosine = np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+
+    # Jaccard overlap of the vocabularies
+    present = tf.copy()
+    present.data[:] = 1.0
+    common = (present @ present.T).toarray()
+    sizes = common.diagonal()
+    union = sizes[:, None] + sizes[None, :] - common
+    overlap = np.divide(common, union, out=np.zeros_like(common), where=union > 0)
+
+    lexical = (cosine * 0.7 + overlap * 0.3) * 100
+    return cosine, overlap, lexical
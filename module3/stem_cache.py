@@ -0,0 +1,88 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Bump when the stemmer or its settings change so old snapshots are ignored
+STEM_SNAPSHOT_VERSION = 1
+
+
+class StemCache:
+    """Bounded LRU of word -> stem, preloadable from a gzipped JSON snapshot
+
+    The stemmer is only called for words missing from the cache, so a worker
+    started from a warm snapshot may never need to import it at all. A
+    snapshot_path is read on the first miss, so a process that never stems
+    never reads it.
+    """
+
+    def __init__(self, stem_function, max_items=100000, snapshot_path=None):
+        self.stem_function = stem_function
+        self.max_items = max_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.modified = False
+        self.pending_snapshot = snapshot_path
+
+    def stem(self, word):
+        with self.lock:
+            stem = self.memory.get(word)
+            if stem is not None:
+                self.memory.move_to_end(word)
+                return stem
+            snapshot, self.pending_snapshot = self.pending_snapshot, None
+
+        if snapshot:
+            self.load(snapshot)
+            return self.stem(word)
+
+        stem = self.stem_function(word)
+        with self.lock:
+            self.memory[word] = stem
+            while len(self.memory) > self.max_items:
+                self.memory.popitem(last=False)
+            self.modified = True
+        return stem
+
+    def __len__(self):
+        return len(self.memory)
+
+    def load(self, path):
+        """Preload a snapshot written by save(), returns the number of stems loaded"""
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            # Missing or unreadable snapshot: start cold
+            return 0
+        if snapshot.get('version') != STEM_SNAPSHOT_VERSION:
+            return 0
+
+        with self.lock:
+            # Snapshot entries run from least to most recently used
+            for word, stem in snapshot['stems'][-self.max_items:]:
+                self.memory.setdefault(word, stem)
+            while len(self.memory) > self.max_items:
+                self.memory.popitem(last=False)
+            return len(self.memory)
+
+    def save(self, path):
+        """Atomically write the cached stems to path, least recently used first"""
+        with self.lock:
+            stems = list(self.memory.items())
+            self.modified = False
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix='.stems-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+                json.dump({'version': STEM_SNAPSHOT_VERSION, 'stems': stems}, f, separators=(',', ':'))
+            # mkstemp creates the file private to this user
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return len(stems)
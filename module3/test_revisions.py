@@ -0,0 +1,102 @@
+"""Checks for /compare/revisions against a plain /compare of the same text
+
+Run from this directory with `python -m unittest test_revisions`.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Keep the test databases and stems out of the real ones
+SCRATCH = tempfile.mkdtemp(prefix='test-revisions-')
+os.environ.update({
+    'CORPUS_DB': os.path.join(SCRATCH, 'corpus.db'),
+    'RESULT_CACHE_DB': os.path.join(SCRATCH, 'results.db'),
+    'REVISIONS_DB': os.path.join(SCRATCH, 'revisions.db'),
+    'FINGERPRINT_DB': os.path.join(SCRATCH, 'fingerprints.db'),
+    'STEM_CACHE_PATH': ''
+})
+
+import app
+from revisions import RevisionStore
+
+FILE2 = "Intro words here. The alpha beta gamma delta epsilon zeta eta text goes on. Filler sentence number two."
+# The run "alpha ... eta" crosses the break between paragraph A and paragraph B
+VERSION1 = "Opening sentence that is unrelated. Then alpha beta gamma.\n\nDelta epsilon zeta eta and more. End of B."
+VERSION2 = ("Opening sentence that is unrelated. Then alpha beta gamma.\n\n"
+            "Delta epsilon zeta eta and more words. End of B changed.")
+VERSION3 = ("Opening sentence, now edited. Then alpha beta gamma.\n\n"
+            "Delta epsilon zeta eta and more words. End of B changed.")
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def tearDownModule():
+    shutil.rmtree(SCRATCH, ignore_errors=True)
+
+
+class RevisionPhraseTest(unittest.TestCase):
+
+    def compare(self, document, text, response_format):
+        with app.app.test_request_context():
+            revision = app.compare_revision(document, text, content_hash(text), FILE2, content_hash(FILE2),
+                                            response_format=response_format)
+            direct = app.compare_documents(text, FILE2, response_format=response_format)
+        return revision, direct
+
+    def test_run_across_edited_paragraph_break(self):
+        # v2 only changes paragraph B, v3 only paragraph A; the run must stay whole both times
+        for response_format in ['compact', 'full']:
+            document = f'boundary-{response_format}'
+            for text in [VERSION1, VERSION2, VERSION3]:
+                revision, direct = self.compare(document, text, response_format)
+                self.assertEqual(revision['similarity_breakdown'], direct['similarity_breakdown'])
+                if response_format == 'compact':
+                    self.assertEqual(revision['highlights'], direct['highlights'])
+                else:
+                    self.assertEqual(revision['matching_sections'], direct['matching_sections'])
+            self.assertEqual(revision['revision']['version'], 3)
+            self.assertEqual(revision['revision']['changed_paragraphs'], 1)
+
+        phrases = revision['matching_sections']['phrases']
+        self.assertIn('alpha beta gamma delta epsilon zeta eta', [phrase['file1_phrase'] for phrase in phrases])
+
+
+class RevisionStoreTest(unittest.TestCase):
+
+    def test_concurrent_versions_get_distinct_numbers(self):
+        path = os.path.join(SCRATCH, 'concurrent.db')
+        RevisionStore(path)
+        versions = []
+        errors = []
+
+        def resubmit(k):
+            try:
+                versions.append(RevisionStore(path).add_version('essay', f'hash-{k}', ['fingerprint']))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=resubmit, args=(k,)) for k in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(versions), list(range(1, 17)))
+
+    def test_paragraph_results_are_bounded(self):
+        store = RevisionStore(os.path.join(SCRATCH, 'bounded.db'), max_disk_bytes=4096)
+        for k in range(100):
+            store.put_paragraphs({f'paragraph-{k}': {'stems': {str(n): os.urandom(8).hex() for n in range(20)}}},
+                                 'file2')
+        kept = store.get_paragraphs([f'paragraph-{k}' for k in range(100)], 'file2')
+        self.assertLess(len(kept), 100)
+        self.assertIn('paragraph-99', kept)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+"""Winnowed document fingerprints for cross-term, cross-course archives
+
+Usage:
+    python winnowing.py ingest submissions/ --collection CSE310-2024F
+    python winnowing.py query essay.txt --min-shared 5
+
+Every run of NOISE_SIZE stems is hashed, and from each window of WINDOW_SIZE
+consecutive hashes the smallest is kept (rightmost on ties), as in MOSS. Any
+shared passage of at least NOISE_SIZE + WINDOW_SIZE - 1 words is therefore
+guaranteed to produce a shared fingerprint, while only about 2 / (WINDOW_SIZE + 1)
+of the hashes are stored.
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+
+from phrase_matcher import rolling_hashes, token_ids
+
+# Words per hashed run; shorter matches are treated as noise
+NOISE_SIZE = 5
+# Hashes per winnowing window; a shared run of NOISE_SIZE + WINDOW_SIZE - 1 words always matches
+WINDOW_SIZE = 4
+
+# Documents fingerprinted in one transaction during bulk ingest
+BULK_BATCH = 500
+
+
+def winnow(hashes, window=WINDOW_SIZE):
+    """[(hash, position)] picked by winnowing, each selection recorded once"""
+    if not hashes:
+        return []
+    if len(hashes) < window:
+        # Too short for a full window: the smallest hash still represents the document
+        position = min(range(len(hashes)), key=lambda p: (hashes[p], -p))
+        return [(hashes[position], position)]
+
+    fingerprints = []
+    min_pos = -1
+    for end in range(window - 1, len(hashes)):
+        start = end - window + 1
+        if min_pos < start:
+            # The previous minimum left the window, rescan it
+            min_pos = start
+            for p in range(start + 1, end + 1):
+                if hashes[p] <= hashes[min_pos]:
+                    min_pos = p
+            fingerprints.append((hashes[min_pos], min_pos))
+        elif hashes[end] <= hashes[min_pos]:
+            min_pos = end
+            fingerprints.append((hashes[min_pos], min_pos))
+    return fingerprints
+
+
+def fingerprint_ids(ids, noise=NOISE_SIZE, window=WINDOW_SIZE):
+    """{fingerprint: first word position} of a sequence of stem IDs"""
+    hashes = rolling_hashes(ids, noise)
+    fingerprints = {}
+    for h, position in winnow(hashes, window):
+        fingerprints.setdefault(h, position)
+    return fingerprints
+
+
+def fingerprint_stems(stems, noise=NOISE_SIZE, window=WINDOW_SIZE):
+    """{fingerprint: first word position} of a stemmed token sequence"""
+    return fingerprint_ids(token_ids(stems), noise, window)
+
+
+class FingerprintStore:
+    """SQLite index from winnowed fingerprints to archived documents
+
+    Only fingerprints are kept, not the text, so the archive can hold hundreds
+    of thousands of documents. Lookups go through the (fingerprint, doc_id)
+    primary key and never load the archive into memory.
+    """
+
+    def __init__(self, db_name="fingerprints.db"):
+        self.db_name = db_name
+        # Created lazily by connect(), so importing the app does not create the database
+        self.initialized = False
+        self.init_lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_name)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self.initialized:
+            self.init_database(conn)
+        return conn
+
+    def init_database(self, conn):
+        with self.init_lock:
+            if self.initialized:
+                return
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    collection TEXT NOT NULL DEFAULT '',
+                    content_hash TEXT UNIQUE NOT NULL,
+                    fingerprint_count INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    fingerprint INTEGER NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    PRIMARY KEY (fingerprint, doc_id)
+                ) WITHOUT ROWID;
+            ''')
+            conn.commit()
+            self.initialized = True
+
+    def insert(self, conn, name, collection, content_hash, fingerprints):
+        row = conn.execute('SELECT id FROM documents WHERE content_hash = ?', (content_hash,)).fetchone()
+        if row:
+            return row[0], False
+
+        cursor = conn.execute('''
+            INSERT INTO documents (name, collection, content_hash, fingerprint_count)
+            VALUES (?, ?, ?, ?)
+        ''', (name, collection, content_hash, len(fingerprints)))
+        doc_id = cursor.lastrowid
+        # Sorted rows land on neighbouring index pages
+        conn.executemany('INSERT OR IGNORE INTO fingerprints (fingerprint, doc_id, position) VALUES (?, ?, ?)',
+                         ((fingerprint, doc_id, position) for fingerprint, position in sorted(fingerprints.items())))
+        return doc_id, True
+
+    def add_document(self, name, content_hash, fingerprints, collection=''):
+        """Store one document's fingerprints, returns (doc_id, created)"""
+        conn = self.connect()
+        try:
+            result = self.insert(conn, name, collection, content_hash, fingerprints)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    def add_documents(self, documents, batch_size=BULK_BATCH):
+        """Bulk ingest an iterable of (name, collection, content_hash, fingerprints)
+
+        Documents are consumed lazily and committed batch_size at a time, so the
+        input can be a generator over a very large directory. Returns the number
+        of new documents.
+        """
+        created_count = 0
+        conn = self.connect()
+        try:
+            pending = 0
+            for name, collection, content_hash, fingerprints in documents:
+                _, created = self.insert(conn, name, collection, content_hash, fingerprints)
+                created_count += created
+                pending += 1
+                if pending >= batch_size:
+                    conn.commit()
+                    pending = 0
+            conn.commit()
+        finally:
+            conn.close()
+        return created_count
+
+    def search(self, fingerprints, min_shared=1, top_k=20, exclude_collection=None):
+        """Archived documents sharing at least min_shared fingerprints, most shared first"""
+        if not fingerprints:
+            return []
+
+        conn = self.connect()
+        try:
+            conn.execute('CREATE TEMP TABLE query (fingerprint INTEGER PRIMARY KEY)')
+            conn.executemany('INSERT OR IGNORE INTO query (fingerprint) VALUES (?)',
+                             ((fingerprint,) for fingerprint in fingerprints))
+            exclude = 'WHERE d.collection != ?' if exclude_collection is not None else ''
+            params = [min_shared] + ([exclude_collection] if exclude_collection is not None else []) + [top_k]
+            # CROSS JOIN keeps the small query table as the outer loop, so the
+            # archive is only touched through its primary key
+            rows = conn.execute(f'''
+                SELECT d.id, d.name, d.collection, d.fingerprint_count, shared.count
+                FROM (
+                    SELECT f.doc_id, COUNT(*) AS count
+                    FROM query q
+                    CROSS JOIN fingerprints f ON f.fingerprint = q.fingerprint
+                    GROUP BY f.doc_id
+                    HAVING COUNT(*) >= ?
+                ) shared
+                JOIN documents d ON d.id = shared.doc_id
+                {exclude}
+                ORDER BY shared.count DESC, d.id
+                LIMIT ?
+            ''', params).fetchall()
+        finally:
+            conn.close()
+
+        query_count = len(fingerprints)
+        return [{
+            'id': doc_id,
+            'name': name,
+            'collection': collection,
+            'shared_fingerprints': shared,
+            'containment': shared / query_count,
+            'archived_containment': shared / doc_count if doc_count else 0.0
+        } for doc_id, name, collection, doc_count, shared in rows]
+
+    def count_documents(self):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+        finally:
+            conn.close()
+
+
+def fingerprint_file(path):
+    """Read, normalize and fingerprint one file - runs in a worker process"""
+    from app import extract_words, simple_stem
+    from batch_compare import read_document
+
+    text = read_document(path)
+    words = extract_words(text)
+    stem_map = {word: simple_stem(word) for word in set(words)}
+    stems = [stem_map[word] for word in words]
+    return path, hashlib.sha256(text.encode('utf-8')).hexdigest(), fingerprint_stems(stems)
+
+
+def ingest_directory(store, directory, collection, workers):
+    from concurrent.futures import ProcessPoolExecutor
+    from batch_compare import SUPPORTED_EXTENSIONS
+
+    paths = sorted(os.path.join(root, name) for root, _, names in os.walk(directory)
+                   for name in names if name.lower().endswith(SUPPORTED_EXTENSIONS))
+
+    def fingerprinted():
+        # Submit a slice at a time so results never pile up ahead of the writer
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for k in range(0, len(paths), BULK_BATCH):
+                for path, content_hash, fingerprints in executor.map(fingerprint_file, paths[k:k+BULK_BATCH],
+                                                                     chunksize=16):
+                    yield os.path.relpath(path, directory), collection, content_hash, fingerprints
+
+    return len(paths), store.add_documents(fingerprinted())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Winnowed fingerprint archive of submissions')
+    parser.add_argument('--db', default='fingerprints.db', help='fingerprint database path')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest = commands.add_parser('ingest', help='fingerprint every .txt/.pdf file under a directory')
+    ingest.add_argument('directory')
+    ingest.add_argument('--collection', default='', help='course or term label stored with each document')
+    ingest.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+
+    query = commands.add_parser('query', help='list archived documents sharing fingerprints with a file')
+    query.add_argument('file')
+    query.add_argument('--min-shared', type=int, default=5, help='fewest shared fingerprints to report')
+    query.add_argument('--top', type=int, default=20, help='most documents to report')
+    query.add_argument('--exclude-collection', help='skip documents from this collection')
+    args = parser.parse_args(argv)
+
+    store = FingerprintStore(args.db)
+    if args.command == 'ingest':
+        found, created = ingest_directory(store, args.directory, args.collection, args.workers)
+        print(f"Fingerprinted {found} files, {created} new; archive holds {store.count_documents()} documents")
+        return 0
+
+    _, _, fingerprints = fingerprint_file(args.file)
+    for match in store.search(fingerprints, args.min_shared, args.top, args.exclude_collection):
+        print(f"{match['shared_fingerprints']:>6}  {match['containment'] * 100:6.2f}%  "
+              f"{match['collection'] or '-':<16} {match['name']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())